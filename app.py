@@ -1,23 +1,349 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session, flash, stream_with_context, g, has_request_context, copy_current_request_context
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
-import google.generativeai as genai
-from google.api_core import exceptions as google_exceptions
-import os, json, datetime, time
+import os, json, datetime, time, threading, uuid, sqlite3, math, heapq, hashlib, difflib, bisect, gzip
 import re
+import logging, logging.handlers, queue, random, sys, atexit, copy, importlib
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# ----------------------
+# Logging
+# ----------------------
+# Log records are written as one JSON object per line (LOG_FORMAT=text for
+# local reading). Request threads only put records on a bounded queue; a
+# listener thread does the formatting and the writing, and records are dropped
+# rather than block a request when the queue is full. Records logged during a
+# request carry its request id, user, model, latency and retry count. Noisy
+# categories (the part of the logger name after "ratna.") can be sampled, e.g.
+# LOG_SAMPLE_RATES="access=0.1,tokens=0.05"; warnings and errors are always kept.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATES = {
+    category.strip(): float(rate)
+    for category, _, rate in (item.partition("=") for item in os.environ.get("LOG_SAMPLE_RATES", "tokens=0.1").split(","))
+    if category.strip()
+}
+
+# Attributes every LogRecord has; anything else was passed as extra= and is logged as a field
+_STANDARD_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _STANDARD_RECORD_FIELDS and v is not None)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def session_user():
+    """The logged-in username, "guest" or None, for logs.
+
+    Static files never read the session: Flask adds Vary: Cookie to any response whose
+    request touched it, and shared caches then won't store the file across users.
+    """
+    if request.endpoint == "static":
+        return None
+    return session.get("username") or ("guest" if session.get("guest") else None)
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the current request's id, user, model, latency and retry count."""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get("request_id")
+            record.user = session_user()
+            record.model = g.get("model")
+            record.retries = g.get("retries")
+            started = g.get("request_started")
+            if started is not None and not hasattr(record, "latency_ms"):
+                record.latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.name.partition(".")[2], 1.0)
+        if rate >= 1.0 or record.levelno >= logging.WARNING:
+            return True
+        record.sample_rate = rate
+        return random.random() < rate
+
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """Queue records for a listener thread, started lazily in each (forked) worker."""
+
+    def __init__(self, target, size=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(size))
+        self.target = target
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self.queue = queue.Queue(self.queue.maxsize)
+                self._listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+                self._listener.start()
+                self._pid = os.getpid()
+                atexit.register(self._listener.stop)  # flush what is still queued
+
+    def prepare(self, record):
+        # Resolve the message and traceback here; the listener only serialises
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging():
+    target = logging.StreamHandler(sys.stdout)
+    target.setFormatter(JSONFormatter() if LOG_FORMAT == "json" else
+                        logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    handler = AsyncLogHandler(target)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    handler.addFilter(RequestContextFilter())
+    logger = logging.getLogger("ratna")
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(handler)
+    logger.propagate = False
+    return logger
+
+
+log = configure_logging()
+access_log = logging.getLogger("ratna.access")
+model_log = logging.getLogger("ratna.models")
+token_log = logging.getLogger("ratna.tokens")
+
+
+def log_context(**fields):
+    """Add fields (model, retries) to the current request's later log records."""
+    if has_request_context():
+        for name, value in fields.items():
+            setattr(g, name, value)
 
 # ----------------------
 # Load Environment & Configure Gemini
 # ----------------------
+# google.generativeai (and the gRPC stack under google.api_core) takes about a
+# second to import, so neither is imported at startup: login and static pages
+# are served straight away and the client library is loaded and configured on
+# the first chat call, or earlier by the warm-up thread (GEMINI_WARMUP).
+GEMINI_WARMUP = os.environ.get("GEMINI_WARMUP", "1").lower() not in ("0", "false", "no")
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# Only looked up once an exception is being handled, by which time Gemini's client is loaded
+google_exceptions = LazyModule("google.api_core.exceptions")
+
 load_dotenv()
 # Prefer os.environ so Render/env vars are definitely read (not only .env)
 _raw_key = (os.environ.get("GEMINI_API_KEY") or os.getenv("GEMINI_API_KEY") or "").strip()
 GEMINI_API_KEY = _raw_key
-if not GEMINI_API_KEY:
-    print("⚠️ WARNING: GEMINI_API_KEY not found. Set it in Render Dashboard → Environment, then redeploy.")
+
+# Everything the app asks of Gemini goes through a backend object with
+# configure(api_key), list_models(request_options=), model(name,
+# system_instruction=None) and generation_config(**options). Its models provide
+# generate_content(prompt, generation_config=, stream=, request_options=),
+# count_tokens(text, request_options=) and start_chat(history=), whose chats
+# provide send_message(message, generation_config=, stream=, request_options=).
+# GEMINI_BACKEND=fake swaps in fake_gemini.FakeGeminiBackend, an offline
+# stand-in used by the benchmarks (benchmarks/bench_app.py).
+GEMINI_BACKEND = os.environ.get("GEMINI_BACKEND", "google").lower()
+
+# Every Gemini call times out after GEMINI_TIMEOUT seconds, and a chat turn,
+# failover retries included, gives up after GEMINI_DEADLINE seconds (keep it
+# below the gunicorn timeout). Each worker opens its own connection after
+# gunicorn forks and keeps it open between calls, so chat requests don't pay
+# for TLS handshakes: gRPC sends keepalive pings every GEMINI_KEEPALIVE seconds
+# (Google's servers refuse pings on an idle connection more often than every 5
+# minutes), and the REST transport keeps up to GEMINI_POOL_SIZE connections.
+GEMINI_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", "60"))
+GEMINI_DEADLINE = float(os.environ.get("GEMINI_DEADLINE", "90"))
+GEMINI_KEEPALIVE = int(os.environ.get("GEMINI_KEEPALIVE", "300"))
+GEMINI_POOL_SIZE = int(os.environ.get("GEMINI_POOL_SIZE", "32"))
+
+
+def call_options(deadline=None):
+    """request_options for one Gemini call: GEMINI_TIMEOUT, cut short by a time.monotonic() deadline."""
+    timeout = GEMINI_TIMEOUT
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            raise google_exceptions.DeadlineExceeded("Gemini did not answer within GEMINI_DEADLINE")
+    return {"timeout": timeout}
+
+
+class GoogleGeminiBackend:
+    """The real Gemini API, through google.generativeai, with one kept-alive connection per worker."""
+    requires_key = True
+    SERVICES = ("generative", "model")  # chat and count_tokens; list_models
+
+    def __init__(self, keepalive=GEMINI_KEEPALIVE, pool_size=GEMINI_POOL_SIZE):
+        # GEMINI_TRANSPORT=rest is set by gunicorn.conf.py for gevent workers
+        self.transport = os.environ.get("GEMINI_TRANSPORT") or "grpc"
+        self.keepalive = keepalive
+        self.pool_size = pool_size
+        self._api_key = None
+        self._genai = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def configure(self, api_key):
+        self._api_key = api_key
+
+    def _client(self):
+        # Built on first use in each process: a gRPC channel must not be used across a fork
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    started = time.perf_counter()
+                    import google.generativeai as genai
+                    genai.configure(api_key=self._api_key, transport=self.transport)
+                    self._install_clients()
+                    self._genai, self._pid = genai, os.getpid()
+                    log.info("Gemini client loaded", extra={
+                        "load_ms": round((time.perf_counter() - started) * 1000, 1), "transport": self.transport})
+        return self._genai
+
+    def _install_clients(self):
+        # genai creates a client per service on demand from a transport name, which
+        # leaves the connection settings at their defaults. Create the clients the app
+        # uses up front, from a transport factory that tunes the connection.
+        # This uses genai's client manager and the callable transport/channel arguments of
+        # the generated clients, hence the minimum versions in requirements.txt.
+        from google.generativeai import client
+        manager = client._client_manager
+        for service in self.SERVICES:
+            client_class = getattr(client.glm, f"{service.title()}ServiceClient")
+            transport_class = client_class.get_transport_class(self.transport)
+            config = dict(manager.client_config, transport=self._transport_factory(transport_class))
+            manager.clients[service] = client_class(**config)
+
+    def _transport_factory(self, transport_class):
+        if self.transport == "rest":
+            import requests
+
+            def make_rest_transport(**kwargs):
+                transport = transport_class(**kwargs)
+                # requests keeps only 10 idle connections per host by default
+                transport._session.mount("https://", requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_size))
+                return transport
+            return make_rest_transport
+
+        options = [("grpc.client_idle_timeout_ms", 2 ** 31 - 1)]  # never close an idle channel
+        if self.keepalive:
+            options += [
+                ("grpc.keepalive_time_ms", self.keepalive * 1000),
+                ("grpc.keepalive_timeout_ms", 20000),
+                ("grpc.keepalive_permit_without_calls", 1),
+                ("grpc.http2.max_pings_without_data", 0),
+            ]
+
+        def create_channel(host, **kwargs):
+            kwargs["options"] = [*kwargs.get("options", ()), *options]
+            return transport_class.create_channel(host, **kwargs)
+
+        def make_grpc_transport(**kwargs):
+            return transport_class(channel=create_channel, **kwargs)
+        return make_grpc_transport
+
+    def warm_up(self):
+        self._client()
+
+    def list_models(self, request_options=None):
+        return self._client().list_models(request_options=request_options)
+
+    def model(self, name, system_instruction=None):
+        return self._client().GenerativeModel(name, system_instruction=system_instruction)
+
+    def generation_config(self, **options):
+        return self._client().types.GenerationConfig(**options)
+
+    def status(self):
+        return {"transport": self.transport, "keepalive": self.keepalive, "pool_size": self.pool_size,
+                "timeout": GEMINI_TIMEOUT, "deadline": GEMINI_DEADLINE, "loaded": self._pid == os.getpid()}
+
+
+def make_gemini_backend(name=GEMINI_BACKEND):
+    if name == "fake":
+        from fake_gemini import FakeGeminiBackend
+        return FakeGeminiBackend()
+    return GoogleGeminiBackend()
+
+
+gemini = make_gemini_backend()
+# Chat is possible once a key is set, or right away with a backend that needs none
+GEMINI_READY = bool(GEMINI_API_KEY) or not gemini.requires_key
+if not gemini.requires_key:
+    log.warning("Using the offline %s Gemini backend; replies are not real", GEMINI_BACKEND)
+elif not GEMINI_API_KEY:
+    log.warning("GEMINI_API_KEY not found. Set it in Render Dashboard → Environment, then redeploy.")
 else:
-    print(f"✓ GEMINI_API_KEY loaded (length={len(GEMINI_API_KEY)}).")
-    genai.configure(api_key=GEMINI_API_KEY)
+    log.info("GEMINI_API_KEY loaded", extra={"key_length": len(GEMINI_API_KEY)})
+    gemini.configure(GEMINI_API_KEY)
+
+
+def start_gemini_warmup():
+    """Load the Gemini client and open its connections in the background, once a worker has booted."""
+    warm_up = getattr(gemini, "warm_up", None)
+    if not (GEMINI_WARMUP and GEMINI_READY and warm_up):
+        return
+
+    def run():
+        try:
+            started = time.perf_counter()
+            warm_up()
+            # Connect both services chat uses, with calls that spend no generation quota:
+            # list_models (the registry keeps the resolved model) and count_tokens
+            model = model_registry.get()
+            model.count_tokens("ping", request_options=call_options())
+            log.info("Gemini connection warmed up", extra={"warmup_ms": round((time.perf_counter() - started) * 1000, 1)})
+        except Exception as warmup_error:
+            log.warning("Gemini warm-up failed: %s", warmup_error)
+
+    threading.Thread(target=run, name="gemini-warmup", daemon=True).start()
 
 # ----------------------
 # Flask Setup
@@ -31,344 +357,1842 @@ FEEDBACKS_FILE = os.path.join(os.path.dirname(__file__), "feedbacks.txt")
 USERNAME_REGEX = re.compile(r'^[A-Za-z@_]+$')  # no longer used; username length only
 PASSWORD_REGEX = re.compile(r'^(?=.*[A-Z])(?=.*\d)[A-Za-z0-9@_]{8,}$')
 
+# ----------------------
+# Metrics (Prometheus)
+# ----------------------
+# Counters and latency histograms are kept in memory per worker and flushed
+# every METRICS_FLUSH_INTERVAL seconds as a snapshot row in METRICS_DB. /metrics
+# adds up the rows of every worker, so it gives the same totals whichever
+# worker answers the scrape. gunicorn.conf.py empties METRICS_DB when the
+# server starts; rows of workers that exited are kept so counters never go back.
+METRICS_DB = os.environ.get("METRICS_DB", os.path.join(os.path.dirname(__file__), "metrics.db"))
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    "ratna_request_duration_seconds": ("histogram", "End-to-end request latency, including the whole streamed body."),
+    "ratna_gemini_duration_seconds": ("histogram", "Latency of Gemini calls, until the last chunk arrived."),
+    "ratna_gemini_retries_total": ("counter", "Gemini calls retried on another model after a model error."),
+    "ratna_gemini_rate_limited_total": ("counter", "Rate-limit (429) errors returned by Gemini."),
+    "ratna_gemini_tokens_total": ("counter", "Tokens reported by Gemini usage metadata."),
+    "ratna_chat_errors_total": ("counter", "Chat replies replaced by an error message, by category."),
+    "ratna_local_replies_total": ("counter", "Chat messages answered locally without Gemini, by intent."),
+    "ratna_answer_cache_lookups_total": ("counter", "First-turn answer cache lookups."),
+    "ratna_single_flight_shared_total": ("counter", "Chat turns answered by another request's identical Gemini call."),
+    "ratna_rate_limited_total": ("counter", "Chat requests refused with HTTP 429, by limit."),
+    "ratna_admission_shed_total": ("counter", "Gemini calls refused to stay within GEMINI_QUOTA, by priority."),
+    "ratna_batch_messages_total": ("counter", "Messages answered through /batch, by source."),
+    "ratna_jobs_total": ("counter", "Chat jobs (job mode) by final status, or rejected when the queue was full."),
+}
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Metrics:
+    def __init__(self, path=METRICS_DB, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._db = None
+
+    def _reset(self):
+        # In a new (forked) worker: start from zero under a fresh id
+        self._pid = os.getpid()
+        self._worker_id = uuid.uuid4().hex
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+        if self.flush_interval > 0:
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram[-1] += seconds
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as flush_error:
+                log.warning("Metrics flush failed: %s", flush_error)
+
+    def _database(self):
+        if self._db is None:
+            self._db = SQLiteDatabase(self.path)
+            with self._db.connect() as conn:
+                conn.execute("""CREATE TABLE IF NOT EXISTS worker_metrics (
+                    worker_id TEXT PRIMARY KEY,
+                    snapshot TEXT NOT NULL,
+                    updated_at REAL NOT NULL)""")
+        return self._db
+
+    def flush(self):
+        """Write this worker's current values to METRICS_DB."""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            snapshot = json.dumps({
+                "counters": [[name, labels, value] for (name, labels), value in self._counters.items()],
+                "histograms": [[name, labels, values] for (name, labels), values in self._histograms.items()],
+            })
+            worker_id = self._worker_id
+        with self._database().connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO worker_metrics (worker_id, snapshot, updated_at) VALUES (?, ?, ?)",
+                (worker_id, snapshot, time.time()))
+
+    def render(self):
+        """All workers' metrics summed, in the Prometheus text exposition format."""
+        self.flush()
+        with self._database().connect() as conn:
+            rows = conn.execute("SELECT snapshot FROM worker_metrics").fetchall()
+        counters, histograms = {}, {}
+        for (snapshot,) in rows:
+            data = json.loads(snapshot)
+            for name, labels, value in data["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in data["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+
+        lines = []
+        for name, (kind, help_text) in METRIC_HELP.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), values[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {values[-1]:.6f}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@app.before_request
+def start_request():
+    g.request_started = time.perf_counter()
+    g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+
+
+@app.after_request
+def finish_request(response):
+    started = g.get("request_started")
+    if started is None or not request.endpoint:
+        return response
+    response.headers["X-Request-ID"] = g.request_id
+    labels = {"endpoint": request.endpoint, "status": str(response.status_code)}
+    request_g = g._get_current_object()
+    fields = {
+        "request_id": g.request_id,
+        "user": session_user(),
+        "method": request.method,
+        "path": request.path,
+        **labels,
+    }
+
+    def on_close():
+        # Called once the whole body, including a streamed one, has been sent
+        elapsed = time.perf_counter() - started
+        metrics.observe("ratna_request_duration_seconds", elapsed, **labels)
+        access_log.info("request", extra={
+            **fields, "model": request_g.get("model"), "retries": request_g.get("retries"),
+            "latency_ms": round(elapsed * 1000, 1)})
+
+    response.call_on_close(on_close)
+    return response
+
+# ----------------------
+# Static Assets, HTTP Caching & Compression
+# ----------------------
+# The chat page's CSS and JS are files in static/, linked with asset_url(),
+# which adds a fingerprint of the file's content (?v=<hash>). The URL changes
+# whenever the file does, so browsers may keep fingerprinted files for a year.
+# HTML pages get an ETag and must be revalidated, which costs a 304 when
+# nothing changed. HTML, JSON, CSS, JS and text responses of at least
+# COMPRESS_MIN_SIZE bytes are compressed with brotli (if the optional brotli
+# package is installed) or gzip, whichever the client accepts. Compressed
+# static files and pages are kept per ETag so they are compressed once.
+# Streamed responses (/stream, NDJSON) are sent uncompressed as they are produced.
+COMPRESS_RESPONSES = os.environ.get("COMPRESS_RESPONSES", "1") != "0"
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "500"))
+COMPRESS_MIMETYPES = {"text/html", "text/css", "text/javascript", "application/javascript",
+                      "application/json", "text/plain", "image/svg+xml"}
+COMPRESS_CACHE_SIZE = 64
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only
+    brotli = None
+
+_asset_versions = {}
+
+
+def asset_url(filename):
+    """URL of a file in static/ with a fingerprint of its content."""
+    version = _asset_versions.get(filename)
+    if version is None or app.debug:
+        with open(os.path.join(app.static_folder, filename), "rb") as f:
+            version = _asset_versions[filename] = hashlib.sha1(f.read()).hexdigest()[:12]
+    return url_for("static", filename=filename, v=version)
+
+
+app.jinja_env.globals["asset_url"] = asset_url
+
+
+class CompressionCache:
+    """Compressed bodies of responses with an ETag (static files, pages), most recently used last."""
+
+    def __init__(self, max_size=COMPRESS_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._bodies = OrderedDict()  # (etag, encoding) -> compressed body
+
+    def get(self, key):
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is not None:
+                self._bodies.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        with self._lock:
+            self._bodies[key] = body
+            while len(self._bodies) > self.max_size:
+                self._bodies.popitem(last=False)
+
+
+compression_cache = CompressionCache()
+
+
+def compress(data, encoding, best=False):
+    # Bodies that are cached are compressed once, so spend more CPU on them
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+
+@app.after_request
+def cache_and_compress(response):
+    if request.endpoint == "static" and request.args.get("v"):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    elif (request.method == "GET" and response.status_code == 200 and response.mimetype == "text/html"
+            and not response.is_streamed):
+        # Pages show the user's name, so only the browser may keep them, and only after revalidating
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.add_etag(weak=True)
+        response.make_conditional(request)
+
+    if (not COMPRESS_RESPONSES or response.status_code != 200 or response.content_encoding
+            or response.mimetype not in COMPRESS_MIMETYPES
+            or (response.is_streamed and not response.direct_passthrough)):
+        return response
+    response.vary.add("Accept-Encoding")
+    if brotli is not None and request.accept_encodings["br"]:
+        encoding = "br"
+    elif request.accept_encodings["gzip"]:
+        encoding = "gzip"
+    else:
+        return response
+    if response.content_length is not None and response.content_length < COMPRESS_MIN_SIZE:
+        return response
+
+    etag, _ = response.get_etag()
+    # Static files are sent straight from disk unless their body is replaced here
+    response.direct_passthrough = False
+    key = (etag, encoding) if etag else None
+    body = compression_cache.get(key) if key else None
+    if body is not None:
+        # A static file's handle is not read on a cache hit
+        close = getattr(response.response, "close", None)
+        if close is not None:
+            close()
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        body = compress(data, encoding, best=key is not None)
+        if key:
+            compression_cache.put(key, body)
+    response.set_data(body)
+    response.content_encoding = encoding
+    response.headers.pop("Accept-Ranges", None)
+    if etag:
+        # The ETag names the uncompressed content; weak, as the encoded bytes differ
+        response.set_etag(etag, weak=True)
+    return response
+
 # ----------------------
 # School Info Context
 # ----------------------
-SCHOOL_INFO = """
-Shree Ratna Rajya Laxmi Secondary School is a reputed educational institution located in Nawalpur, Nepal.
-It is committed to providing quality education with a perfect blend of academic excellence, moral values, and practical learning.
-
-👨‍💻 Chatbot Creators:
-This chatbot was created by Mr. Aayush Subedi and Mrs. Anjana Shrestha as an OJT (On-the-Job Training) project.
-- Aayush Subedi: Grade 12 Computer Engineering student at Shree Ratna Rajya Laxmi Secondary School
-  Email: aayushsubedi334@gmail.com
-- Anjana Shrestha: Grade 12 Computer Engineering student at Shree Ratna Rajya Laxmi Secondary School
-  Email: anjanashrestha4562@gmail.com
-
-📍 Location:
-Shree Ratna Rajya Laxmi Secondary School, Gaindakot-10, Nawalpur, Nepal.
-
-🎓 Administration:
-Principal: Mr. Nawaraj Kafle
-Head of Engineering Department: Mr. Ganesh Gharti
-
-🏫 General Information:
-Established Year: 2025 B.S. (1980 A.D.)
-Type: Public Community-Based School
-Affiliated To: National Examination Board (NEB), Government of Nepal
-Grades Offered: Nursery to Grade 12
-Streams for +2 Level: Science, Management, and Computer Engineering
-Computer Engineering is from class 9-12
-Medium of Instruction: English and Nepali
-Total Students: More than 1200 students
-Total Teachers and Staff: More than 60 teachers and staff members
-
-⏰ School Hours:
-Sunday to Friday: 10:00 AM – 4:00 PM
-Saturday: Closed
-Break Time: 12:30 PM – 1:00 PM
-
-📅 Important Events:
-Annual Function: Every Bhadra (August/September)
-Sports Week: Every Falgun (February/March)
-Parents-Teachers Meeting: Every Trimester
-Cultural Day: Organized once a year to promote Nepali heritage
-Examination System: Unit Tests, Terminal Exams, and Final Board Exams
-
-🎯 Motto:
-"Knowledge is Power"
-
-💻 Facilities:
-- Smart Classrooms with multimedia setup
-- Computer and Science Laboratories
-- Library with digital and printed resources
-- Playground and sports equipment
-- Music, Dance, and Art Rooms
-- Health and Counseling Unit
-- Transportation service within Kathmandu Valley
-- CCTV monitored campus for safety
-
-👨‍🏫 Teaching Methodology:
-The school focuses on project-based learning, digital education, and practical exposure.
-Teachers are trained to promote creativity, teamwork, and moral discipline among students.
-
-🏆 Achievements:
-- Consistent 100% pass results in SEE examinations.
-- Awarded as “Best Community Secondary School” by the Education Board in 2079 B.S.
-- Students actively participate in inter-school quiz competitions, science fairs, and debates.
-
-🌍 Extracurricular Activities:
-- Sports (Football, Basketball, Volleyball, Table Tennis)
-- Arts, Music, and Drama
-- Debate, Quiz, and Public Speaking Clubs
-- Community Service and Environmental Awareness Programs
-- Scout and Red Cross Youth Circle
-
-📬 Contact Details:
-Phone: 078-402005 
-Email: ratnarajya2025@gmail.com 
-Website: www.ratnaschool.edu.np
-Facebook: https://www.facebook.com/profile.php?id=100063770297066
-
-Teachers and Staffs details:
-1. Name: Nawaraj Kafle
-   Subject: English
-   Qualification: M.Ed
-   Position/Class: Principal
-
-2. Name: Lila Dhungana
-   Subject: Nepali
-   Qualification: M.A / B.Ed
-   Class: Grade 12 (Education)
-
-3. Name: Tak Narayan Rana
-   Subject: Mathematics
-   Qualification: M.Ed
-   Class: Grade 10 'A'
-
-4. Name: Chandrakanta Acharya
-   Subject: Science
-   Qualification: B.Sc / B.Ed
-   Class: Grade 9 'A'
-
-5. Name: Chandrakanta Bhandari
-   Subject: Science
-   Qualification: M.A / B.Sc
-   Class: Grade 10 'B'
-
-6. Name: Dinesh Kandel
-   Subject: English
-   Qualification: M.A / B.Ed
-   Class: Grade 11 (Management)
-
-7. Name: Sudan Ghimire
-   Subject: Accountancy
-   Qualification: MBS / B.Ed
-   Class: Grade 12 (Management)
-
-8. Name: Somnath Nyaupane
-   Subject: English
-   Qualification: B.A / B.Ed
-   Class: Grade 8 'B'
-
-9. Name: Narayan Prasad Kandel
-   Subject: Accountancy
-   Qualification: I.Sc / B.B.S
-
-10. Name: Goma Chital
-    Subject: Social Studies
-    Qualification: B.Ed
-
-11. Name: Bimala Subedi
-    Subject: Mathematics
-    Qualification: B.Ed
-    Class: Grade 6 'A'
-
-12. Name: Sita Devi Sharma
-    Subject: Nepali
-    Qualification: I.Ed
-    Class: Grade 1 'B'
-
-13. Name: Sumitra Kumari Sharma
-    Subject: Mathematics
-    Qualification: I.Ed
-    Class: Grade 3 'B'
-
-14. Name: Durga Prasad Nyaupane
-    Subject: Nepali
-    Qualification: B.A / B.Ed
-    Position: Librarian
-
-15. Name: Parbati Rijal
-    Subject: English
-    Qualification: M.A / B.Ed
-    Class: Grade 8 'C'
-
-16. Name: Bishnu Maya Sapkota
-    Subject: Social Studies
-    Qualification: M.Ed
-    Class: Grade 5 'B'
-
-17. Name: Tulasi Sharma
-    Subject: English
-    Qualification: I.Ed
-    Class: Grade 5 'C'
-
-18. Name: Pawan Bhattarai
-    Subject: English
-    Qualification: M.Ed
-    Class: Grade 7 'B'
-
-19. Name: Bikash Poudel
-    Subject: Nepali
-    Qualification: M.A / B.Ed
-    Class: Grade 11 (Education)
-
-20. Name: Ramesh Soti
-    Subject: English
-    Qualification: M.Ed
-    Class: Grade 6 'B'
-
-21. Name: Yogendra Prasad Dhungana
-    Subject: English
-    Qualification: M.Ed
-    Class: Grade 8 'A'
-
-22. Name: Suraksha Kandel
-    Subject: English
-    Qualification: +2 Education
-    Class: Grade 3 'A'
-
-23. Name: Satyata Mishra Kamal
-    Subject: Social Studies
-    Qualification: M.A / B.Ed
-    Class: Grade 4 'B'
-
-24. Name: Yamkala Poudel
-    Subject: Science
-    Qualification: BNS / B.Ed
-    Class: Grade 2 'A'
-
-25. Name: Hira Kumari Mahato
-    Subject: Grade Teacher
-    Qualification: B.Ed
-    Class: Nursery 'A'
-
-26. Name: Prakash Bhupal
-    Subject: Mathematics
-    Qualification: M.Sc Mathematics
-    Class: Grade 7 'A'
-
-27. Name: Sujina Acharya
-    Subject: Accountancy
-    Qualification: MBS
-    Class: Grade 9 'B'
-
-28. Name: Pratik Ghimire
-    Subject: H.M.
-    Qualification: B.H.M
-
-29. Name: Ramchandra Sapkota
-    Subject: English
-    Qualification: B.A
-    Class: Grade 4 'A'
-
-30. Name: Navaraj Mahato
-    Subject: Science
-    Qualification: +2 Science
-
-31. Name: Aksha Shrestha
-    Subject: English
-    Qualification: +2 Management
-    Class: UKG 'A'
-
-32. Name: Bhavana Adhikari
-    Subject: Science
-    Qualification: +2 Science
-    Class: Grade 5 'A'
-
-
-===============================
-TECHNICAL & VOCATIONAL STREAM
-===============================
-
-33. Name: Er. Ganesh Bartaula
-    Subject: Computer Engineering
-    Qualification: BE Computer
-    Position: HOD
-
-34. Name: Shiva G.C.
-    Subject: Physics
-    Qualification: M.Sc Physics / B.Ed
-    Class: Grade 12 (Engineering)
+# The school knowledge lives in a data file (SCHOOL_INFO_FILE, school_info.txt)
+# in the format chunk_school_info parses: sections start with a "Title:" line
+# and staff are numbered "N. Name: ..." entries. Workers notice edits within
+# SCHOOL_INFO_CHECK_INTERVAL seconds and reload without a restart. A new version
+# must still contain staff entries and the sections the intent router answers
+# from, and keep at least SCHOOL_INFO_MIN_CHUNK_RATIO of the previous version's
+# chunks; otherwise (e.g. a truncated upload) the previous version stays in use.
+SCHOOL_INFO_FILE = os.environ.get("SCHOOL_INFO_FILE", os.path.join(os.path.dirname(__file__), "school_info.txt"))
+SCHOOL_INFO_CHECK_INTERVAL = float(os.environ.get("SCHOOL_INFO_CHECK_INTERVAL", "5"))
+SCHOOL_INFO_MIN_CHUNK_RATIO = float(os.environ.get("SCHOOL_INFO_MIN_CHUNK_RATIO", "0.5"))
 
-35. Name: Asmita Bhusal
-    Subject: Chemistry
-    Qualification: M.Sc Chemistry
 
-36. Name: Er. Uday Adhikari
-    Subject: Computer Engineering
-    Qualification: BE Computer
+# ----------------------
+# School Knowledge Retrieval
+# ----------------------
+# The school info is split into chunks (one per section, one per staff member) and
+# indexed with BM25, so each prompt carries only the few chunks relevant to the
+# question instead of the whole text.
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "6"))
+
+SECTION_HEADER_REGEX = re.compile(r"^(?:[^\w\s]+\s*)?([A-Z][^:]*):\s*$")
+STAFF_ENTRY_REGEX = re.compile(r"^\d+\.\s+Name:")
+WORD_REGEX = re.compile(r"[a-z0-9]+")
+PUNCTUATION_REGEX = re.compile(r"[^\w\s]")
+STOP_WORDS = {
+    "a", "an", "and", "are", "at", "be", "can", "do", "does", "for", "from", "how", "i", "in",
+    "is", "it", "me", "my", "of", "on", "or", "tell", "the", "their", "there", "this", "to",
+    "was", "what", "when", "where", "which", "who", "whom", "with", "you", "your", "about",
+}
+
+KnowledgeChunk = namedtuple("KnowledgeChunk", ["title", "text", "fields"])
+
+
+def tokenize(text):
+    tokens = []
+    for word in WORD_REGEX.findall(text.lower()):
+        if word in STOP_WORDS:
+            continue
+        # Light plural stemming so "teachers" matches "teacher"
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def normalize_query(text):
+    """Lower-case, strip punctuation and collapse whitespace: 'Who is the Principal?' -> 'who is the principal'."""
+    return " ".join(PUNCTUATION_REGEX.sub(" ", text.lower()).split())
+
+
+def parse_staff_entry(lines):
+    """Turn '1. Name: ...' plus its 'Key: value' lines into a dict with lower-case keys."""
+    fields = {}
+    for line in lines:
+        key, _, value = line.strip().partition(":")
+        key = re.sub(r"^\d+\.\s+", "", key).strip().lower()
+        if value.strip():
+            fields[key] = value.strip()
+    return fields
+
+
+def chunk_school_info(text):
+    """Split the school info text into a chunk per section and per staff entry."""
+    chunks = []
+    title, body, staff_lines = "Overview", [], None
+
+    def flush_staff():
+        if staff_lines:
+            fields = parse_staff_entry(staff_lines)
+            entry = "\n".join(line.strip() for line in staff_lines)
+            chunks.append(KnowledgeChunk(f"Staff: {fields.get('name', '')}", entry, fields))
+
+    def flush_section():
+        section = "\n".join(body).strip()
+        if section:
+            chunks.append(KnowledgeChunk(title, section, {}))
+
+    for line in text.splitlines():
+        header = SECTION_HEADER_REGEX.match(line)
+        if header and not line.startswith(" "):
+            flush_staff()
+            flush_section()
+            title, body, staff_lines = header.group(1).strip(), [], None
+        elif STAFF_ENTRY_REGEX.match(line):
+            flush_staff()
+            staff_lines = [line]
+        elif staff_lines is not None:
+            if line.strip():
+                staff_lines.append(line)
+        else:
+            body.append(line)
+    flush_staff()
+    flush_section()
+    return chunks
+
+
+class BM25Index:
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths = []
+        self.postings = {}  # term -> [(doc index, term frequency)]
+        for i, doc in enumerate(documents):
+            tokens = tokenize(doc)
+            self.doc_lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                self.postings.setdefault(token, []).append((i, tf))
+        n = len(documents)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query, k):
+        """Return [(doc index, score)] for the k best matches with a positive score."""
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / self.avg_length)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def retrieve_passages(query, k=RETRIEVAL_TOP_K, knowledge=None):
+    """Return the k chunks most relevant to the query as "Title:\ntext" passages ([] if nothing matches)."""
+    knowledge = knowledge or school_knowledge.current()
+    hits = knowledge.index.search(query, k)
+    # Keep the original order so related entries read naturally
+    return [knowledge.passages[i] for i, _ in sorted(hits)]
 
-37. Name: Er. Suman Adhikari
-    Subject: Computer Engineering
-    Qualification: BE Electronics
+# ----------------------
+# Local Intent Router
+# ----------------------
+# Structured questions ("who teaches Grade 10 'B'", "school phone number",
+# "what are school hours") are answered straight from the parsed school info
+# without calling Gemini. A question is answered locally only when exactly one
+# intent matches with confidence >= INTENT_CONFIDENCE_THRESHOLD; anything
+# else falls through to Gemini. Confidence is the share of the question's
+# content words the match accounts for, so "who is the principal" is answered
+# locally but "who is the principal of Harvard University" is not; naming
+# another organisation ("university", "movie", ...) halves it.
+INTENT_CONFIDENCE_THRESHOLD = float(os.environ.get("INTENT_CONFIDENCE_THRESHOLD", "0.8"))
+INTENT_MAX_WORDS = 12  # longer messages are usually more than a lookup
+
+# Short, polite replies for very simple greetings (avoid long AI answers)
+SIMPLE_GREETINGS = {
+    "hi", "hi.", "hi!", "hello", "hello.", "hello!",
+    "hey", "hey.", "hey!", "namaste", "namaste.", "namaste!",
+    "good morning", "good morning.", "good morning!",
+    "good afternoon", "good afternoon.", "good afternoon!",
+    "good evening", "good evening.", "good evening!"
+}
+GREETING_REPLY = "Hello! How can I help you today?"
+
+TEACH_REGEX = re.compile(r"\b(teach|teaches|teaching|teacher|teachers|taught|sir|miss|madam)\b")
+SECTION_INTENTS = [
+    ("hours", "School Hours", re.compile(
+        r"\b(school (hours|timings?|time)|opening hours|break time|lunch break|"
+        r"(when|what time) (does|do|is) (the )?school (start|open|close|end|finish|over))\b")),
+    ("contact", "Contact Details", re.compile(
+        r"\b(phone|telephone|contact|email|e mail|website|web site|facebook)\b")),
+    ("events", "Important Events", re.compile(
+        r"\b(events?|annual function|sports week|cultural day|parents? teachers? meeting|ptm)\b")),
+]
+POSITION_ALIASES = {
+    "hod": ["head of department", "head of engineering", "head of engineering department"],
+    "school nurse": ["nurse"],
+    "bus driver": ["driver", "drivers"],
+    "security guard": ["security", "guard"],
+    "canteen operator": ["canteen"],
+    "office staff accounts": ["accountant", "office staff"],
+}
+SUBJECT_ALIASES = {
+    "mathematics": ["math", "maths"],
+    "accountancy": ["account", "accounts"],
+    "social studies": ["social"],
+}
+IGNORED_POSITIONS = {"staff"}  # too generic to answer "who is the staff"
+
+# Words that don't change what a lookup question asks for (on top of STOP_WORDS)
+QUERY_FILLER_WORDS = {
+    "am", "were", "will", "would", "could", "should", "please", "kindly", "give", "show", "list", "get",
+    "know", "want", "need", "any", "all", "some", "that", "these", "those", "they", "them", "its", "has",
+    "have", "s", "whats", "name", "names", "details", "detail", "info", "information", "number", "address",
+    "id", "page", "link", "us", "we", "our", "here", "current", "upcoming", "next", "important", "sir",
+    "miss", "madam",
+}
+# Words that tie a question to this school; they count as covered for every intent
+SCHOOL_ANCHORS = {"school", "ratna", "rajya", "laxmi", "shree", "campus"}
+OTHER_ORGANISATION_REGEX = re.compile(
+    r"\b(universit(y|ies)|college|company|companies|corporation|hospital|bank|government|ministry|"
+    r"movie|film|novel)\b")  # nouns only; "show", "book" or "app" are as often verbs or school words
+
+IntentMatch = namedtuple("IntentMatch", ["intent", "reply", "confidence"])
+
+
+class IntentRouter:
+    def __init__(self, chunks, threshold=INTENT_CONFIDENCE_THRESHOLD):
+        self.threshold = threshold
+        self.greetings = {normalize_query(g) for g in SIMPLE_GREETINGS}
+        self.sections = {chunk.title: chunk for chunk in chunks if not chunk.fields}
+        self.by_name, self.by_position, self.by_subject, self.by_class = {}, {}, {}, {}
+        for chunk in chunks:
+            staff = chunk.fields
+            if not staff:
+                continue
+            name = normalize_query(staff.get("name", ""))
+            self.by_name[name] = staff
+            if name.startswith("er "):
+                self.by_name[name[3:]] = staff
+            position = normalize_query(staff.get("position") or staff.get("position/class") or "")
+            if position and position not in IGNORED_POSITIONS:
+                for key in [position] + POSITION_ALIASES.get(position, []):
+                    self.by_position.setdefault(key, []).append(staff)
+            subject = normalize_query(staff.get("subject", ""))
+            if subject:
+                for key in [subject] + SUBJECT_ALIASES.get(subject, []):
+                    self.by_subject.setdefault(key, []).append(staff)
+            cls = normalize_query(staff.get("class", ""))
+            if cls:
+                self.by_class.setdefault(cls, []).append(staff)
+                # "grade 10" also matches every section of grade 10
+                grade = re.match(r"(grade \d+|nursery|ukg|lkg)\b", cls)
+                if grade and grade.group(1) != cls:
+                    self.by_class.setdefault(grade.group(1), []).append(staff)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "local": 0, "ambiguous": 0, "low_confidence": 0, "intents": {}}
+
+    @staticmethod
+    def _ngrams(words, max_n=4):
+        for n in range(max_n, 0, -1):
+            for i in range(len(words) - n + 1):
+                yield " ".join(words[i:i + n])
+
+    @staticmethod
+    def _staff_card(staff):
+        return "\n".join(f"{key.title()}: {value}" for key, value in staff.items())
+
+    @staticmethod
+    def _names(staff_list):
+        return ", ".join(staff["name"] for staff in staff_list)
+
+    def _lookup(self, index, grams):
+        # Longest phrase wins ("computer engineering" over "computer")
+        for gram in grams:
+            if gram in index:
+                return gram, index[gram]
+        return None, None
+
+    @staticmethod
+    def _coverage(content, *phrases):
+        """Share of the content words that the matched phrases (or a school anchor) account for."""
+        if not content:
+            return 1.0
+        covered = SCHOOL_ANCHORS.union(*(phrase.split() for phrase in phrases))
+        return sum(word in covered for word in content) / len(content)
+
+    def _match(self, text):
+        """Return every intent matching the normalised text as IntentMatch tuples."""
+        if text in self.greetings:
+            return [IntentMatch("greeting", GREETING_REPLY, 1.0)]
+        words = text.replace("class ", "grade ").split()
+        grams = list(self._ngrams(words))
+        content = [word for word in words if word not in STOP_WORDS and word not in QUERY_FILLER_WORDS]
+        teach_words = " ".join(TEACH_REGEX.findall(text))
+        matches = []
+
+        name, staff = self._lookup(self.by_name, grams)
+        if staff:
+            # "nawaraj kafle qualification" is still about the card
+            fields = " ".join(WORD_REGEX.findall(" ".join(staff)))
+            matches.append(IntentMatch("staff", self._staff_card(staff), self._coverage(content, name, fields, teach_words)))
+        cls, staff_list = self._lookup(self.by_class, grams)
+        if staff_list:
+            reply = "\n".join(f"{s['class']}: {s['name']}" + (f" ({s['subject']})" if s.get("subject") else "") for s in staff_list)
+            matches.append(IntentMatch("class", reply, self._coverage(content, cls, teach_words)))
+        position, staff_list = self._lookup(self.by_position, grams)
+        if staff_list:
+            title = staff_list[0].get("position") or staff_list[0].get("position/class")
+            matches.append(IntentMatch("position", f"{title}: {self._names(staff_list)}", self._coverage(content, position)))
+        if teach_words:
+            subject, staff_list = self._lookup(self.by_subject, grams)
+            if staff_list:
+                matches.append(IntentMatch("subject", f"{staff_list[0]['subject']} teachers: {self._names(staff_list)}",
+                                           self._coverage(content, subject, teach_words)))
+        for intent, title, pattern in SECTION_INTENTS:
+            chunk = self.sections.get(title)
+            found = pattern.search(text) if chunk else None
+            if found:
+                matches.append(IntentMatch(intent, f"{title}:\n{chunk.text}", self._coverage(content, found.group(0))))
+
+        if OTHER_ORGANISATION_REGEX.search(text):
+            matches = [m._replace(confidence=m.confidence * 0.5) for m in matches]
+        if len(words) > INTENT_MAX_WORDS:
+            matches = [m._replace(confidence=m.confidence * 0.7) for m in matches]
+        return matches
+
+    def route(self, user_message):
+        """Return an IntentMatch to answer locally, or None to fall through to Gemini."""
+        matches = self._match(normalize_query(user_message))
+        confident = [m for m in matches if m.confidence >= self.threshold]
+        with self._lock:
+            self.stats["requests"] += 1
+            if len(confident) > 1:
+                # e.g. a teacher's name and a class in one question; let Gemini reason about it
+                self.stats["ambiguous"] += 1
+                return None
+            if not confident:
+                if matches:
+                    self.stats["low_confidence"] += 1
+                return None
+            match = confident[0]
+            self.stats["local"] += 1
+            self.stats["intents"][match.intent] = self.stats["intents"].get(match.intent, 0) + 1
+            return match
+
+    def status(self):
+        with self._lock:
+            requests = self.stats["requests"]
+            return {
+                "local_fraction": round(self.stats["local"] / requests, 3) if requests else None,
+                **self.stats,
+                "intents": dict(self.stats["intents"]),
+            }
 
-38. Name: Er. Nirjal Koirala
-    Subject: Computer Engineering
-    Qualification: BE Computer
-    Class: Grade 11 (Engineering)
 
-39. Name: Krishna Prasad Nyaupane
-    Subject: Computer Engineering
-    Qualification: BCA
-    Class: Grade 9 'C'
+# ----------------------
+# School Knowledge Base (hot reload)
+# ----------------------
+# Everything derived from one version of the school info file. A reload builds
+# a complete new snapshot and then swaps it in with a single assignment, so a
+# request never sees chunks, index and router from different versions. The
+# version (a hash of the text) also keys the answer cache. Intent router stats
+# restart with each snapshot. passages holds each chunk formatted for prompts.
+SchoolKnowledge = namedtuple("SchoolKnowledge", ["version", "chunks", "passages", "index", "router", "tokens", "signature"])
+
+
+class SchoolKnowledgeBase:
+    def __init__(self, path=SCHOOL_INFO_FILE, check_interval=SCHOOL_INFO_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._current = None
+        self._checked_at = 0.0
+        self.stats = {"loads": 0, "reload_errors": 0}
+
+    def current(self):
+        """The current snapshot, loading it on first use and reloading it if the file changed."""
+        knowledge = self._current
+        if knowledge is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return knowledge
+        with self._lock:
+            if self._current is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._current
+            self._checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+                signature = (stat.st_mtime_ns, stat.st_size)
+                if self._current is None or signature != self._current.signature:
+                    self._current = self._load(signature)
+            except (OSError, UnicodeError, ValueError) as load_error:
+                if self._current is None:
+                    raise
+                # Keep answering from the last good version (e.g. the file is mid-upload)
+                self.stats["reload_errors"] += 1
+                log.warning("School info reload failed, keeping the previous version: %s", load_error)
+            return self._current
+
+    def _load(self, signature):
+        with open(self.path, "r", encoding="utf-8") as f:
+            text = f.read()
+        version = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        if self._current is not None and version == self._current.version:
+            return self._current._replace(signature=signature)  # touched but not changed
+        chunks = chunk_school_info(text)
+        self._validate(chunks)
+        knowledge = SchoolKnowledge(
+            version=version,
+            chunks=chunks,
+            passages=[f"{chunk.title}:\n{chunk.text}" for chunk in chunks],
+            index=BM25Index([f"{chunk.title}\n{chunk.text}" for chunk in chunks]),
+            router=IntentRouter(chunks),
+            tokens=len(text) // 4,  # rough estimate, ~4 characters per token
+            signature=signature,
+        )
+        self.stats["loads"] += 1
+        log.info("Loaded school info", extra={"path": self.path, "version": version[:12], "chunks": len(chunks)})
+        return knowledge
+
+    def _validate(self, chunks):
+        """Raise ValueError unless the chunks look like a complete school info file."""
+        if not chunks:
+            raise ValueError(f"no sections found in {self.path}")
+        if not any(chunk.fields for chunk in chunks):
+            raise ValueError(f"no staff entries found in {self.path}")
+        titles = {chunk.title for chunk in chunks}
+        missing = [title for _, title, _ in SECTION_INTENTS if title not in titles]
+        if missing:
+            raise ValueError(f"sections missing from {self.path}: {', '.join(missing)}")
+        previous = self._current
+        if previous is not None and len(chunks) < len(previous.chunks) * SCHOOL_INFO_MIN_CHUNK_RATIO:
+            raise ValueError(f"{self.path} has {len(chunks)} chunks, down from {len(previous.chunks)}")
+
+    def status(self):
+        knowledge = self._current
+        return {
+            "path": self.path,
+            "version": knowledge.version[:12] if knowledge else None,
+            "chunks": len(knowledge.chunks) if knowledge else 0,
+            **self.stats,
+        }
+
+
+school_knowledge = SchoolKnowledgeBase()
 
-40. Name: Dilliram Poudel
-    Subject: Computer Engineering
-    Qualification: Diploma in Computer
-    Class: Grade 10 'C'
 
-41. Name: Sagar Shrestha
-    Subject: Computer
-    Qualification: BCA
+# ----------------------
+# System Instruction
+# ----------------------
+# Static persona, passed once per model as Gemini's system_instruction instead
+# of being re-sent inside every user message. The school info relevant to each
+# question is retrieved per turn (see PromptBuilder).
+# Gemini context caching needs a far larger prefix than this, so it is not used.
+SYSTEM_INSTRUCTION = """You are Ratna Chatbot — an intelligent and helpful AI assistant for Shree Ratna Rajya Laxmi Secondary School, Kathmandu. You have excellent memory and can handle both school-related and general questions with intelligence and professionalism.
 
+School and Date/Time Information:
+- Each user message starts with context in square brackets, added by the system and not typed by the user: the current date and time, and the parts of the school info relevant to the question.
+- Answer school questions from that school info. If it does not cover the question, say you don't have that detail rather than guessing.
 
-===============================
-SCHOOL STAFF & OFFICE ASSISTANTS
-===============================
+Your personality and capabilities:
+- You are intelligent, knowledgeable, and can answer general questions about science, history, geography, current events, technology, culture, and more with depth and accuracy.
+- You remember previous parts of the conversation and can reference earlier topics naturally.
+- You provide thoughtful, well-reasoned answers to complex questions.
+- You can engage in friendly discussions, explain concepts clearly, and adapt your communication style to the user's needs.
 
-42. Name: Sachin Adhikari
-    Qualification: +2 Management
-    Position: Office Staff (Accounts)
+Your tasks:
+- Answer questions about the school (principal, fees, exams, events, contact info, classes, etc.) with detailed and accurate information.
+- Handle general knowledge questions intelligently — provide comprehensive, accurate answers with examples when helpful.
+- Reply naturally to casual chat (greetings, small talk, etc.) with warmth and professionalism.
+- When asked about time, date, or "what time is it", "what date is it", "what day is it", provide the current date and time given with the latest message.
+- Remember and reference previous conversation topics when relevant to show continuity and memory.
+- If asked about something you don't know, admit it honestly but offer to help find related information.
+- Keep responses conversational, engaging, and informative while maintaining a professional tone.
 
-43. Name: Pratima Thapa
-    Qualification: Bachelor of Nursing
-    Position: School Nurse
+Guidelines:
+- Be friendly, approachable, and professional.
+- Use emojis sparingly and appropriately (😊, 🎓, 📚, etc.) when suitable.
+- Vary your response style — sometimes be more formal, sometimes more casual, depending on the question.
+- Show genuine interest in helping and engaging with the user.
+- Maintain a professional and helpful demeanor.
+- Provide helpful, intelligent, and engaging responses."""
 
-44. Name: Hari Bahadur Poudel
-    Qualification: Literate
-    Position: Assistant Staff
 
-45. Name: Saraswati Pathak
-    Qualification: Literate
-    Position: Aya
+# ----------------------
+# Gemini Model Registry
+# ----------------------
+# Resolving a model means a list_models() round trip, so do it once per worker
+# and keep the result for MODEL_CACHE_TTL seconds. Once the TTL expires the
+# cached model keeps serving while a background thread refreshes it.
+MODEL_CACHE_TTL = int(os.environ.get("GEMINI_MODEL_TTL", "3600"))
+
+
+class ModelUnavailable(Exception):
+    """Raised when no Gemini model with generateContent support can be used."""
+
+
+class ModelRegistry:
+    def __init__(self, ttl=MODEL_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._candidates = []
+        self._index = 0
+        self._model = None
+        self._model_name = None
+        self._resolved_at = 0.0
+        self._refreshing = False
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "failovers": 0, "errors": 0}
+
+    def _list_candidates(self):
+        model_log.debug("Listing available models")
+        candidates = []
+        for m in gemini.list_models(request_options=call_options()):
+            if "generateContent" in getattr(m, "supported_generation_methods", []):
+                candidates.append(m.name)
+        model_log.info("Found %d models supporting generateContent", len(candidates))
+        if not candidates:
+            raise ModelUnavailable("No models with generateContent support found. Please check your API key and access permissions.")
+        return candidates
+
+    def _build(self, candidates, start):
+        """Return (index, name, model) for the first usable candidate from start."""
+        for i in range(start, len(candidates)):
+            avail_model = candidates[i]
+            # Try with the model name as-is first, then the bare model ID
+            names = [avail_model]
+            if "/" in avail_model:
+                names.append(avail_model.split("/")[-1])
+            for name in names:
+                try:
+                    model = gemini.model(name, system_instruction=SYSTEM_INSTRUCTION)
+                    model_log.info("Using model %s", name)
+                    return i, name, model
+                except Exception as model_error:
+                    model_log.debug("Model %s failed: %s", name, model_error)
+        return None
+
+    def _resolve(self):
+        candidates = self._list_candidates()
+        built = self._build(candidates, 0)
+        if built is None:
+            raise ModelUnavailable(f"Found {len(candidates)} models but none could be used. Please check your API key permissions.")
+        index, name, model = built
+        with self._lock:
+            self._candidates = candidates
+            self._index, self._model_name, self._model = index, name, model
+            self._resolved_at = time.monotonic()
+            self.stats["refreshes"] += 1
+        return model
+
+    def _refresh_in_background(self):
+        try:
+            self._resolve()
+        except Exception as refresh_error:
+            self.stats["errors"] += 1
+            model_log.warning("Background model refresh failed: %s", refresh_error)
+        finally:
+            self._refreshing = False
+
+    def get(self):
+        """Return the cached model, resolving it synchronously on first use."""
+        with self._lock:
+            model = self._model
+            if model is not None:
+                self.stats["hits"] += 1
+                expired = time.monotonic() - self._resolved_at > self.ttl
+                if expired and not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, daemon=True).start()
+                return model
+            self.stats["misses"] += 1
+        try:
+            return self._resolve()
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+
+    def failover(self, failed_model):
+        """Drop a model that returned NotFound/PermissionDenied and move to the next candidate.
+
+        Returns the replacement model, or None when every candidate is exhausted.
+        """
+        with self._lock:
+            if self._model is not failed_model and self._model is not None:
+                # Another request already failed over; use its choice
+                return self._model
+            candidates, start = self._candidates, self._index + 1
+            self.stats["failovers"] += 1
+        built = self._build(candidates, start)
+        if built is None:
+            # The cached candidate list may be stale; re-resolve from scratch once
+            with self._lock:
+                self._model = None
+            try:
+                model = self._resolve()
+            except Exception:
+                return None
+            return None if model is failed_model else model
+        index, name, model = built
+        with self._lock:
+            self._index, self._model_name, self._model = index, name, model
+            self._resolved_at = time.monotonic()
+        return model
+
+    def status(self):
+        with self._lock:
+            age = time.monotonic() - self._resolved_at if self._model is not None else None
+            return {
+                "model": self._model_name,
+                "candidates": len(self._candidates),
+                "age_seconds": round(age, 1) if age is not None else None,
+                "ttl_seconds": self.ttl,
+                **self.stats,
+            }
+
+
+model_registry = ModelRegistry()
+# ----------------------
+# Upstream Health (Circuit Breaker)
+# ----------------------
+# Instead of sleeping inside a request on a 429, every request in the worker
+# reports rate limits here. Once UPSTREAM_429_THRESHOLD of them land within
+# UPSTREAM_429_WINDOW seconds (or Gemini sends a retry-after hint) the circuit
+# opens and requests get a fast degraded reply until the cool-down ends. After
+# that a single probe request is let through; if it is rate limited again the
+# cool-down doubles, up to UPSTREAM_MAX_COOLDOWN.
+UPSTREAM_429_THRESHOLD = int(os.environ.get("UPSTREAM_429_THRESHOLD", "3"))
+UPSTREAM_429_WINDOW = float(os.environ.get("UPSTREAM_429_WINDOW", "60"))
+UPSTREAM_COOLDOWN = float(os.environ.get("UPSTREAM_COOLDOWN", "30"))
+UPSTREAM_MAX_COOLDOWN = float(os.environ.get("UPSTREAM_MAX_COOLDOWN", "300"))
+
+RETRY_IN_REGEX = re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE)
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling Gemini while the rate-limit circuit is open or the quota is spent."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Gemini calls paused by rate limiting; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def retry_after_hint(error):
+    """Seconds to wait suggested by a rate-limit error (RetryInfo, Retry-After header or message), or None."""
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and hasattr(delay, "seconds"):
+            return delay.seconds + delay.nanos / 1e9
+        if isinstance(detail, dict) and detail.get("retryDelay"):
+            try:
+                return float(str(detail["retryDelay"]).rstrip("s"))
+            except ValueError:
+                pass
+    response = getattr(error, "response", None)
+    header = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    match = RETRY_IN_REGEX.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+class UpstreamHealth:
+    PROBE_TIMEOUT = 60  # seconds before a stuck half-open probe is given up on
+
+    def __init__(self, threshold=UPSTREAM_429_THRESHOLD, window=UPSTREAM_429_WINDOW,
+                 cooldown=UPSTREAM_COOLDOWN, max_cooldown=UPSTREAM_MAX_COOLDOWN):
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._recent = deque()  # timestamps of recent 429s
+        self._open_until = 0.0
+        self._trips = 0
+        self._probe_started = None
+        self.stats = {"rate_limits": 0, "trips": 0, "rejected": 0}
+
+    def check(self):
+        """Raise UpstreamUnavailable if requests should not reach Gemini right now.
+
+        Returns True if this call is the half-open probe; the caller must then call
+        release_probe() once the call is over, however it ended.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._open_until:
+                self.stats["rejected"] += 1
+                raise UpstreamUnavailable(self._open_until - now)
+            if self._trips:
+                # Half-open: let one probe through at a time
+                if self._probe_started is not None and now - self._probe_started < self.PROBE_TIMEOUT:
+                    self.stats["rejected"] += 1
+                    raise UpstreamUnavailable(self.cooldown)
+                self._probe_started = now
+                return True
+            return False
+
+    def release_probe(self):
+        """The probe ended without a verdict (e.g. its client went away); let the next call probe."""
+        with self._lock:
+            self._probe_started = None
+
+    def record_rate_limit(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            self.stats["rate_limits"] += 1
+            metrics.inc("ratna_gemini_rate_limited_total")
+            self._recent.append(now)
+            while self._recent and now - self._recent[0] > self.window:
+                self._recent.popleft()
+            if retry_after is None and not self._trips and len(self._recent) < self.threshold:
+                return
+            # Repeated trips (a failed probe) back off exponentially
+            cooldown = min(self.cooldown * (2 ** self._trips), self.max_cooldown)
+            if retry_after is not None:
+                cooldown = min(max(retry_after, 1.0), self.max_cooldown)
+            self._open_until = now + cooldown
+            self._trips += 1
+            self._probe_started = None
+            self._recent.clear()
+            self.stats["trips"] += 1
+            log.warning("Gemini rate limited; pausing upstream calls", extra={"cooldown_seconds": round(cooldown, 1)})
+
+    def record_available(self):
+        """Gemini answered without a rate limit; close the circuit."""
+        with self._lock:
+            self._trips = 0
+            self._probe_started = None
+
+    def status(self):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._open_until:
+                state = "open"
+            elif self._trips:
+                state = "half_open"
+            else:
+                state = "closed"
+            return {
+                "state": state,
+                "retry_after_seconds": round(max(self._open_until - now, 0.0), 1),
+                "recent_rate_limits": len(self._recent),
+                **self.stats,
+            }
+
+
+upstream_health = UpstreamHealth()
 
-46. Name: Mina Poudel
-    Qualification: Literate
-    Position: Staff
+# ----------------------
+# Answer Cache
+# ----------------------
+# Most traffic is the same few school questions. First-turn answers (no chat
+# history to depend on) are cached per worker under a normalised form of the
+# question. Each answer is tagged with the school info version it was generated
+# from and only served for that version, so editing the school info
+# invalidates all cached answers. Questions about the date or time are
+# never cached.
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "500"))
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_FUZZY = os.environ.get("ANSWER_CACHE_FUZZY", "").lower() in ("1", "true", "yes")
+ANSWER_CACHE_FUZZY_CUTOFF = 0.9
+ERROR_REPLY_PREFIX = "⚠️"  # error and busy replies (EMPTY_REPLY, gemini_error_reply, ...) are never cached
+
+TIME_SENSITIVE_REGEX = re.compile(r"\b(time|date|day|today|tonight|now|tomorrow|yesterday|week|month|year)\b")
+
+
+class AnswerCache:
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, fuzzy=ANSWER_CACHE_FUZZY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.fuzzy = fuzzy
+        self._lock = threading.Lock()
+        self._answers = OrderedDict()  # normalised question -> (stored_at, answer, school info version)
+        self._version = None
+        self.stats = {"hits": 0, "fuzzy_hits": 0, "misses": 0, "stores": 0}
+
+    def _check_version(self, version):
+        # Drop everything when the school info changes
+        if self._version != version:
+            self._answers.clear()
+            self._version = version
+
+    @staticmethod
+    def cacheable(question):
+        return bool(question) and not TIME_SENSITIVE_REGEX.search(question)
+
+    def _lookup(self, key, version):
+        entry = self._answers.get(key)
+        if entry is None:
+            return None
+        stored_at, answer, answer_version = entry
+        if answer_version != version or time.monotonic() - stored_at > self.ttl:
+            del self._answers[key]
+            return None
+        self._answers.move_to_end(key)
+        return answer
+
+    def get(self, user_message, version):
+        key = normalize_query(user_message)
+        if not self.cacheable(key):
+            return None
+        with self._lock:
+            self._check_version(version)
+            answer = self._lookup(key, version)
+            if answer is None and self.fuzzy:
+                close = difflib.get_close_matches(key, list(self._answers), n=1, cutoff=ANSWER_CACHE_FUZZY_CUTOFF)
+                answer = self._lookup(close[0], version) if close else None
+                if answer is not None:
+                    self.stats["fuzzy_hits"] += 1
+            self.stats["hits" if answer is not None else "misses"] += 1
+            metrics.inc("ratna_answer_cache_lookups_total", result="hit" if answer is not None else "miss")
+            return answer
+
+    def put(self, user_message, answer, version):
+        """Store an answer generated from the given school info version (dropped if that is outdated)."""
+        key = normalize_query(user_message)
+        if not answer or answer.startswith(ERROR_REPLY_PREFIX) or not self.cacheable(key):
+            return
+        with self._lock:
+            if version != self._version:
+                return
+            self._answers[key] = (time.monotonic(), answer, version)
+            self._answers.move_to_end(key)
+            self.stats["stores"] += 1
+            while len(self._answers) > self.max_size:
+                self._answers.popitem(last=False)
+
+    def status(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "size": len(self._answers),
+                "hit_ratio": round(self.stats["hits"] / lookups, 3) if lookups else None,
+                **self.stats,
+            }
+
+
+answer_cache = AnswerCache()
 
-47. Name: Sita Kshetri
-    Qualification: Literate
-    Position: Aya
+# ----------------------
+# Single-Flight (Duplicate Prompt Collapsing)
+# ----------------------
+# After an announcement many students ask the same first question at once.
+# Concurrent identical first-turn questions share one Gemini call: the first
+# request (the leader) calls Gemini and the rest wait for its reply. Set
+# SINGLE_FLIGHT_DIR to also share calls between gunicorn workers through lock
+# files (needs fcntl, i.e. not on Windows). Lock and reply files are deleted
+# once unused for SINGLE_FLIGHT_FILE_TTL seconds.
+SINGLE_FLIGHT_DIR = os.environ.get("SINGLE_FLIGHT_DIR", "")
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", "120"))
+SINGLE_FLIGHT_FILE_TTL = 60
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Errors that say more about the leader (its priority, its quota turn) than about the
+    # question; followers make their own call instead of sharing them
+    PRIVATE_ERRORS = (UpstreamUnavailable,)
+
+    def __init__(self, lock_dir=SINGLE_FLIGHT_DIR, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.lock_dir = lock_dir if lock_dir and fcntl is not None else ""
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> _Flight
+        self._swept = 0.0
+        self.stats = {"leaders": 0, "followers": 0, "shared_across_workers": 0}
+
+    def join(self, key):
+        """Return (flight, is_leader). The leader must call complete() when done."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.stats["followers"] += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self.stats["leaders"] += 1
+            return flight, True
+
+    def complete(self, key, flight, result=None, error=None):
+        """Publish the leader's result or error; with neither (e.g. the leader's client went
+        away), followers make their own call."""
+        if isinstance(error, self.PRIVATE_ERRORS):
+            error = None
+        flight.result, flight.error = result, error
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.done.set()
+
+    def wait(self, flight):
+        """The leader's result; raises its error. Returns None if it took longer than the timeout
+        or finished without a result to share. An empty result is Gemini's empty reply, which
+        callers report as an error rather than an answer."""
+        if not flight.done.wait(self.timeout):
+            return None
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def do(self, key, fn):
+        """Run fn() once for all concurrent callers with the same key and return its result."""
+        flight, leader = self.join(key)
+        if not leader:
+            result = self.wait(flight)
+            if result is not None:
+                metrics.inc("ratna_single_flight_shared_total")
+                return result
+            # The leader is stuck or gave up; make our own call
+            return fn()
+        try:
+            result = self._across_workers(key, fn) if self.lock_dir else fn()
+        except Exception as e:
+            self.complete(key, flight, error=e)
+            raise
+        self.complete(key, flight, result=result)
+        return result
+
+    def _across_workers(self, key, fn):
+        # Workers asking the same question queue on an exclusive file lock. The
+        # first computes the reply and writes it next to the lock; the others
+        # find a reply written after they started waiting and reuse it.
+        path = os.path.join(self.lock_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+        self._sweep()
+        started = time.time()
+        with self._locked(path + ".lock"):
+            try:
+                if os.path.getmtime(path + ".json") >= started:
+                    with open(path + ".json", "r", encoding="utf-8") as f:
+                        result = json.load(f)["result"]
+                    with self._lock:
+                        self.stats["shared_across_workers"] += 1
+                    metrics.inc("ratna_single_flight_shared_total")
+                    return result
+            except (OSError, ValueError, KeyError):
+                pass
+            result = fn()
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"result": result}, f)
+            os.replace(tmp_path, path + ".json")
+            return result
+
+    @staticmethod
+    @contextmanager
+    def _locked(lock_path):
+        # Reopen if the sweep deleted the file while we waited for it; locking the
+        # deleted file would not exclude a worker that created a new one
+        while True:
+            lock_file = open(lock_path, "a")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+        try:
+            os.utime(lock_path)  # in use; keeps the sweep away
+            yield
+        finally:
+            lock_file.close()  # releases the lock
+
+    def _sweep(self):
+        """Delete lock and reply files unused for SINGLE_FLIGHT_FILE_TTL seconds (checked once a TTL per worker)."""
+        now = time.time()
+        with self._lock:
+            if now - self._swept < SINGLE_FLIGHT_FILE_TTL:
+                return
+            self._swept = now
+        try:
+            entries = list(os.scandir(self.lock_dir))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if now - entry.stat().st_mtime < SINGLE_FLIGHT_FILE_TTL:
+                    continue
+                if not entry.name.endswith(".lock"):
+                    os.unlink(entry.path)  # a reply (or a write that never finished) nobody can still be waiting for
+                    continue
+                with open(entry.path, "a") as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # in use
+                    os.unlink(entry.path)
+            except OSError:
+                pass
 
-48. Name: Laxmi Kandel
-    Qualification: Literate
-    Position: Staff
+    def status(self):
+        with self._lock:
+            return {"in_flight": len(self._flights), "cross_worker": bool(self.lock_dir), **self.stats}
 
-49. Name: Chandra Datt Kandel
-    Qualification: Literate
-    Position: Bus Driver
 
-50. Name: Durga Thapa
-    Qualification: Literate
-    Position: Bus Driver
+single_flight = SingleFlight()
 
-51. Name: Mohan Kumar Dhungana
-    Qualification: Literate
-    Position: Security Guard
 
-52. Name: Shiva Poudel
-    Qualification: +2 Hotel Management
-    Position: Canteen Operator
+# ----------------------
+# SQLite Helper
+# ----------------------
+class SQLiteDatabase:
+    """One lazily opened connection per worker process (reopened after gunicorn forks)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    @contextmanager
+    def connect(self, immediate=False):
+        """Yield the worker's connection inside a transaction.
+
+        immediate=True takes the write lock up front, so a read followed by a write
+        in the same transaction can't race with another worker doing the same.
+        """
+        with self.lock:
+            conn = self._connection()
+            with conn:
+                if immediate:
+                    conn.execute("BEGIN IMMEDIATE")
+                yield conn
 
-📚 Mission:
-To develop responsible, confident, and compassionate learners prepared to contribute to a changing world.
 
-🌟 Vision:
-To be recognized as a model school offering holistic education through innovation, discipline, and values.
+# ----------------------
+# Conversation Store
+# ----------------------
+# Chat history lives on the server, keyed by a conversation id; the session
+# cookie only carries that id. Each conversation keeps at most
+# CONVERSATION_MAX_MESSAGES messages and is dropped after CONVERSATION_TTL
+# seconds without activity.
+CONVERSATION_STORE = os.environ.get("CONVERSATION_STORE", "sqlite").lower()
+CONVERSATIONS_DB = os.environ.get("CONVERSATIONS_DB", os.path.join(os.path.dirname(__file__), "conversations.db"))
+CONVERSATION_MAX_MESSAGES = int(os.environ.get("CONVERSATION_MAX_MESSAGES", "100"))
+CONVERSATION_TTL = int(os.environ.get("CONVERSATION_TTL", "86400"))
+CONVERSATION_CACHE_SIZE = int(os.environ.get("CONVERSATION_CACHE_SIZE", "1000"))
+
+
+# A conversation as stored: its newest messages, the absolute index of the first
+# of them (older ones may have been trimmed), and the running summary covering
+# every message before summary_upto.
+ConversationState = namedtuple("ConversationState", ["id", "messages", "offset", "summary", "summary_upto"])
+
+
+class MemoryConversationStore:
+    """In-process LRU store; history is per worker and lost on restart."""
+
+    def __init__(self, max_messages=CONVERSATION_MAX_MESSAGES, ttl=CONVERSATION_TTL, max_conversations=CONVERSATION_CACHE_SIZE):
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.max_conversations = max_conversations
+        self._lock = threading.Lock()
+        self._conversations = OrderedDict()  # id -> {"last_seen", "messages", "total", "summary", "summary_upto"}
+
+    def get_state(self, conversation_id):
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is not None and time.time() - entry["last_seen"] > self.ttl:
+                del self._conversations[conversation_id]
+                entry = None
+            if entry is None:
+                return ConversationState(conversation_id, [], 0, "", 0)
+            self._conversations.move_to_end(conversation_id)
+            messages = list(entry["messages"])
+            return ConversationState(conversation_id, messages, entry["total"] - len(messages),
+                                     entry["summary"], entry["summary_upto"])
+
+    def get(self, conversation_id):
+        return self.get_state(conversation_id).messages
+
+    def append(self, conversation_id, messages):
+        with self._lock:
+            entry = self._conversations.pop(conversation_id, None) or {
+                "messages": [], "total": 0, "summary": "", "summary_upto": 0}
+            entry["messages"] = (entry["messages"] + messages)[-self.max_messages:]
+            entry["total"] += len(messages)
+            entry["last_seen"] = time.time()
+            self._conversations[conversation_id] = entry
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+
+    def set_summary(self, conversation_id, summary, summary_upto):
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            # Never move the summary backwards if an older update finishes last
+            if entry is not None and summary_upto > entry["summary_upto"]:
+                entry["summary"], entry["summary_upto"] = summary, summary_upto
+
+    def delete(self, conversation_id):
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+
+class SQLiteConversationStore:
+    """SQLite-backed store shared by every worker on the instance."""
+
+    PURGE_INTERVAL = 300  # seconds between sweeps for idle conversations
+
+    def __init__(self, path=CONVERSATIONS_DB, max_messages=CONVERSATION_MAX_MESSAGES, ttl=CONVERSATION_TTL):
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.db = SQLiteDatabase(path)
+        self._last_purge = 0.0
+        with self.db.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                summary TEXT NOT NULL DEFAULT '',
+                summary_upto INTEGER NOT NULL DEFAULT 0)""")
+            # Databases created before summaries existed lack the last three columns
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(conversations)")}
+            for column, definition in (("total", "INTEGER NOT NULL DEFAULT 0"),
+                                       ("summary", "TEXT NOT NULL DEFAULT ''"),
+                                       ("summary_upto", "INTEGER NOT NULL DEFAULT 0")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE conversations ADD COLUMN {column} {definition}")
+            conn.execute("""CREATE TABLE IF NOT EXISTS messages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, seq)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations (updated_at)")
+
+    def get_state(self, conversation_id):
+        with self.db.connect() as conn:
+            row = conn.execute(
+                "SELECT updated_at, total, summary, summary_upto FROM conversations WHERE id = ?",
+                (conversation_id,)).fetchone()
+            if row is None or time.time() - row[0] > self.ttl:
+                return ConversationState(conversation_id, [], 0, "", 0)
+            rows = conn.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY seq",
+                (conversation_id,)).fetchall()
+        messages = [{"role": role, "content": content} for role, content in rows]
+        _, total, summary, summary_upto = row
+        return ConversationState(conversation_id, messages, total - len(messages), summary, summary_upto)
+
+    def get(self, conversation_id):
+        return self.get_state(conversation_id).messages
+
+    def append(self, conversation_id, messages):
+        now = time.time()
+        with self.db.connect() as conn:
+            conn.execute(
+                "INSERT INTO conversations (id, updated_at, total) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at, total = total + excluded.total",
+                (conversation_id, now, len(messages)))
+            conn.executemany(
+                "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                [(conversation_id, m["role"], m["content"]) for m in messages])
+            # Keep only the newest max_messages for this conversation
+            conn.execute(
+                "DELETE FROM messages WHERE conversation_id = ? AND seq <= ("
+                "SELECT seq FROM messages WHERE conversation_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                (conversation_id, conversation_id, self.max_messages))
+            if now - self._last_purge > self.PURGE_INTERVAL:
+                self._last_purge = now
+                self._purge_idle(conn, now)
+
+    def set_summary(self, conversation_id, summary, summary_upto):
+        with self.db.connect() as conn:
+            # Never move the summary backwards if an older update finishes last
+            conn.execute(
+                "UPDATE conversations SET summary = ?, summary_upto = ? WHERE id = ? AND summary_upto < ?",
+                (summary, summary_upto, conversation_id, summary_upto))
+
+    def _purge_idle(self, conn, now):
+        cutoff = now - self.ttl
+        conn.execute(
+            "DELETE FROM messages WHERE conversation_id IN (SELECT id FROM conversations WHERE updated_at < ?)",
+            (cutoff,))
+        conn.execute("DELETE FROM conversations WHERE updated_at < ?", (cutoff,))
+
+    def delete(self, conversation_id):
+        with self.db.connect() as conn:
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+
+if CONVERSATION_STORE == "memory":
+    conversation_store = MemoryConversationStore()
+else:
+    conversation_store = SQLiteConversationStore()
+
+
+def new_conversation():
+    """Start a fresh conversation for this session, dropping the previous one."""
+    old_id = session.pop("conversation_id", None)
+    if old_id:
+        conversation_store.delete(old_id)
+    session["conversation_id"] = uuid.uuid4().hex
+    return session["conversation_id"]
+
+
+def current_conversation_id():
+    return session.get("conversation_id") or new_conversation()
+
+# ----------------------
+# User Store
+# ----------------------
+USERS_DB = os.environ.get("USERS_DB", os.path.join(os.path.dirname(__file__), "users.db"))
+
+
+class SQLiteUserStore:
+    """Usernames and password hashes in SQLite, with a unique index on username."""
+
+    def __init__(self, path=USERS_DB):
+        self.db = SQLiteDatabase(path)
+        with self.db.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS users (
+                username TEXT NOT NULL,
+                password_hash TEXT NOT NULL,
+                created_at REAL NOT NULL)""")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username)")
+
+    def get_password_hash(self, username):
+        with self.db.connect() as conn:
+            row = conn.execute("SELECT password_hash FROM users WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else None
+
+    def create(self, username, password_hash):
+        """Add a user; returns False if the username is already taken."""
+        try:
+            with self.db.connect() as conn:
+                conn.execute(
+                    "INSERT INTO users (username, password_hash, created_at) VALUES (?, ?, ?)",
+                    (username, password_hash, time.time()))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def count(self):
+        with self.db.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def import_json(self, path):
+        """Copy users from a users.json file; existing usernames are left untouched."""
+        with open(path, "r") as f:
+            users = json.load(f)
+        now = time.time()
+        with self.db.connect() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO users (username, password_hash, created_at) VALUES (?, ?, ?)",
+                [(username, password_hash, now) for username, password_hash in users.items()])
+            return conn.total_changes - before
+
+
+user_store = SQLiteUserStore()
+
+# Seed a fresh database (e.g. after a Render redeploy) from the legacy users.json
+if os.path.exists(USERS_FILE) and user_store.count() == 0:
+    log.info("Imported %d users from %s", user_store.import_json(USERS_FILE), os.path.basename(USERS_FILE))
+
+
+@app.cli.command("import-users")
+def import_users_command():
+    """Import accounts from users.json into the user database."""
+    print(f"Imported {user_store.import_json(USERS_FILE)} new users from {USERS_FILE}")
 
-"""
+# ----------------------
+# Feedback Store
+# ----------------------
+FEEDBACKS_DB = os.environ.get("FEEDBACKS_DB", os.path.join(os.path.dirname(__file__), "feedbacks.db"))
+FEEDBACK_PAGE_SIZE = 50
+FEEDBACK_MAX_PAGE_SIZE = 200
+
+
+class SQLiteFeedbackStore:
+    """Append-only feedback log; deletes only set a tombstone (deleted_at)."""
+
+    def __init__(self, path=FEEDBACKS_DB):
+        self.db = SQLiteDatabase(path)
+        with self.db.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS feedbacks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                deleted_at REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_feedbacks_live ON feedbacks (id) WHERE deleted_at IS NULL")
+
+    def add(self, text):
+        with self.db.connect() as conn:
+            cur = conn.execute("INSERT INTO feedbacks (text, created_at) VALUES (?, ?)", (text, time.time()))
+            return cur.lastrowid
+
+    def delete(self, feedback_id):
+        """Tombstone one feedback; returns False if it does not exist or is already deleted."""
+        with self.db.connect() as conn:
+            cur = conn.execute(
+                "UPDATE feedbacks SET deleted_at = ? WHERE id = ? AND deleted_at IS NULL",
+                (time.time(), feedback_id))
+            return cur.rowcount > 0
+
+    def delete_all(self):
+        with self.db.connect() as conn:
+            conn.execute("UPDATE feedbacks SET deleted_at = ? WHERE deleted_at IS NULL", (time.time(),))
+
+    def count(self, include_deleted=False):
+        query = "SELECT COUNT(*) FROM feedbacks"
+        if not include_deleted:
+            query += " WHERE deleted_at IS NULL"
+        with self.db.connect() as conn:
+            return conn.execute(query).fetchone()[0]
+
+    def list(self, page=1, size=FEEDBACK_PAGE_SIZE):
+        """Return one page of live feedbacks, oldest first."""
+        with self.db.connect() as conn:
+            rows = conn.execute(
+                "SELECT id, text, created_at FROM feedbacks WHERE deleted_at IS NULL ORDER BY id LIMIT ? OFFSET ?",
+                (size, (page - 1) * size)).fetchall()
+        return [
+            {"id": fid, "text": text, "created_at": datetime.datetime.fromtimestamp(created_at).strftime("%Y-%m-%d %H:%M")}
+            for fid, text, created_at in rows
+        ]
+
+    def import_text(self, path, only_if_empty=False):
+        """Copy entries from the legacy '---' separated feedbacks.txt; returns how many were added.
+
+        With only_if_empty, nothing is added if the table has ever held a feedback
+        (checked in the same transaction, so concurrently booting workers import once).
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            feedbacks = [fb.strip() for fb in f.read().split("---") if fb.strip()]
+        now = time.time()
+        with self.db.connect(immediate=True) as conn:
+            if only_if_empty and conn.execute("SELECT 1 FROM feedbacks LIMIT 1").fetchone():
+                return 0
+            conn.executemany("INSERT INTO feedbacks (text, created_at) VALUES (?, ?)", [(fb, now) for fb in feedbacks])
+        return len(feedbacks)
+
+
+feedback_store = SQLiteFeedbackStore()
+
+# Seed a fresh database from the legacy feedbacks.txt
+if os.path.exists(FEEDBACKS_FILE):
+    imported = feedback_store.import_text(FEEDBACKS_FILE, only_if_empty=True)
+    if imported:
+        log.info("Imported %d feedbacks from %s", imported, os.path.basename(FEEDBACKS_FILE))
+
+
+# ----------------------
+# Rate Limiting & Admission Control
+# ----------------------
+# Chat requests are limited per session (conversation), per logged-in user and
+# per client IP with token buckets ("N/seconds": bursts of N, refilled at N per
+# that many seconds), checked before any other work so an abusive client gets a
+# cheap 429. Separately, every Gemini call takes a token from a global bucket
+# sized to the upstream quota (GEMINI_QUOTA); guests and background summaries
+# may not use the last ADMISSION_USER_RESERVE share of it, so near the quota
+# guest traffic is queued briefly and then shed while logged-in users still get
+# through. The client limits are kept per worker by default; RATE_LIMIT_BACKEND=sqlite
+# shares them between gunicorn workers through RATE_LIMIT_DB. The Gemini quota is
+# one allowance for the whole deployment, so its bucket is always in RATE_LIMIT_DB.
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB", os.path.join(os.path.dirname(__file__), "ratelimits.db"))
+RATE_LIMIT_SESSION = os.environ.get("RATE_LIMIT_SESSION", "20/60")
+RATE_LIMIT_USER = os.environ.get("RATE_LIMIT_USER", "30/60")
+RATE_LIMIT_IP = os.environ.get("RATE_LIMIT_IP", "300/60")  # a whole school may share one address
+GEMINI_QUOTA = os.environ.get("GEMINI_QUOTA", "15/60")
+ADMISSION_USER_RESERVE = float(os.environ.get("ADMISSION_USER_RESERVE", "0.3"))
+ADMISSION_GUEST_WAIT = float(os.environ.get("ADMISSION_GUEST_WAIT", "2"))
+
+# Behind Render's proxy the client address is in X-Forwarded-For
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ.get("PROXY_HOPS", "1")))
+
+
+def parse_rate(spec):
+    """'N/seconds' -> (capacity, tokens per second); '0' or 'off' disables the limit."""
+    if spec.strip().lower() in ("", "0", "off", "none"):
+        return None
+    count, _, seconds = spec.partition("/")
+    capacity = float(count)
+    return capacity, capacity / float(seconds or 1)
+
+
+class MemoryBucketBackend:
+    """Token buckets in this worker's memory."""
+    MAX_KEYS = 20000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, updated)
+
+    def take(self, key, capacity, rate, cost=1, reserve=0.0):
+        """Take cost tokens unless that leaves fewer than reserve; return seconds to wait (0 if taken)."""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens - cost >= reserve:
+                self._buckets[key] = (tokens - cost, now)
+                if len(self._buckets) > self.MAX_KEYS:
+                    self._prune(now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (cost + reserve - tokens) / rate
+
+    def _prune(self, now):
+        # A bucket idle for a minute has refilled under the default rates, so it is as good as new
+        for key in [k for k, (_, updated) in self._buckets.items() if now - updated > 60]:
+            del self._buckets[key]
+
+
+class SQLiteBucketBackend:
+    """Token buckets shared by all workers; each take is a single atomic UPSERT."""
+
+    def __init__(self, path=RATE_LIMIT_DB):
+        self.db = SQLiteDatabase(path)
+        with self.db.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL)""")
+        self._last_prune = 0.0
+
+    def take(self, key, capacity, rate, cost=1, reserve=0.0):
+        now = time.time()
+        refilled = "MIN(:capacity, tokens + (:now - updated) * :rate)"
+        with self.db.connect() as conn:
+            cur = conn.execute(f"""INSERT INTO buckets (key, tokens, updated)
+                SELECT :key, :capacity - :cost, :now WHERE :capacity - :cost >= :reserve
+                ON CONFLICT(key) DO UPDATE SET tokens = {refilled} - :cost, updated = :now
+                WHERE {refilled} - :cost >= :reserve""",
+                {"key": key, "capacity": capacity, "rate": rate, "cost": cost, "reserve": reserve, "now": now})
+            if cur.rowcount:
+                if now - self._last_prune > 300:
+                    self._last_prune = now
+                    conn.execute("DELETE FROM buckets WHERE updated < ?", (now - 3600,))
+                return 0.0
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        tokens = min(capacity, row[0] + (now - row[1]) * rate) if row else capacity
+        return max(cost + reserve - tokens, 0.0) / rate
+
+
+class RateLimiter:
+    def __init__(self, backend, session_rate=RATE_LIMIT_SESSION, user_rate=RATE_LIMIT_USER,
+                 ip_rate=RATE_LIMIT_IP):
+        self.backend = backend
+        self.specs = {"session": session_rate, "user": user_rate, "ip": ip_rate}
+        self.rates = {scope: parse_rate(spec) for scope, spec in self.specs.items()}
+        self._lock = threading.Lock()
+        self.stats = {"allowed": 0, "limited_session": 0, "limited_user": 0, "limited_ip": 0}
+
+    def check(self, conversation_id, username, ip, cost=1):
+        """Return 0 if cost requests are within every limit, else seconds until the client may retry."""
+        for scope, ident in (("ip", ip), ("user", username), ("session", conversation_id)):
+            rate = self.rates[scope]
+            if rate is None or not ident:
+                continue
+            retry_after = self.backend.take(f"{scope}:{ident}", *rate, cost=cost)
+            if retry_after:
+                with self._lock:
+                    self.stats[f"limited_{scope}"] += 1
+                metrics.inc("ratna_rate_limited_total", limit=scope)
+                return retry_after
+        with self._lock:
+            self.stats["allowed"] += 1
+        return 0.0
+
+    def status(self):
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "limits": self.specs,
+                **self.stats,
+            }
+
+
+class AdmissionController:
+    """Spends the global Gemini quota, keeping a reserve that only logged-in users may use."""
+    KEY = "global:gemini"
+
+    def __init__(self, backend, quota=GEMINI_QUOTA, user_reserve=ADMISSION_USER_RESERVE,
+                 guest_wait=ADMISSION_GUEST_WAIT):
+        self.backend = backend
+        self.rate = parse_rate(quota)
+        self.reserve = self.rate[0] * user_reserve if self.rate else 0.0
+        self.guest_wait = guest_wait
+        self._lock = threading.Lock()
+        self.stats = {"admitted": 0, "queued": 0, "shed_user": 0, "shed_guest": 0, "shed_background": 0}
+
+    def admit(self, priority="user"):
+        """Take one Gemini call from the quota or raise UpstreamUnavailable.
+
+        priority is "user", "guest" or "background". Guests wait up to guest_wait
+        seconds for quota before being shed; the others are never delayed.
+        """
+        if self.rate is None:
+            return
+        reserve = 0.0 if priority == "user" else self.reserve
+        retry_after = self.backend.take(self.KEY, *self.rate, reserve=reserve)
+        if retry_after and priority == "guest" and retry_after <= self.guest_wait:
+            with self._lock:
+                self.stats["queued"] += 1
+            time.sleep(retry_after)
+            retry_after = self.backend.take(self.KEY, *self.rate, reserve=reserve)
+        with self._lock:
+            if retry_after:
+                self.stats[f"shed_{priority}"] += 1
+            else:
+                self.stats["admitted"] += 1
+        if retry_after:
+            metrics.inc("ratna_admission_shed_total", priority=priority)
+            raise UpstreamUnavailable(retry_after)
+
+    def status(self):
+        with self._lock:
+            return {"quota": GEMINI_QUOTA, "user_reserve": round(self.reserve, 1), **self.stats}
+
+
+shared_bucket_backend = SQLiteBucketBackend()
+bucket_backend = shared_bucket_backend if RATE_LIMIT_BACKEND == "sqlite" else MemoryBucketBackend()
+rate_limiter = RateLimiter(bucket_backend)
+admission = AdmissionController(shared_bucket_backend)
+
+
+def request_priority():
+    return "user" if "username" in session else "guest"
+
+
+def rate_limit_retry_after(conversation_id, cost=1):
+    """Seconds this client must wait before its next chat request (0 when allowed); a batch costs one per message."""
+    return rate_limiter.check(conversation_id, session.get("username"), request.remote_addr, cost)
+
+
+def rate_limited_reply(retry_after):
+    return f"⚠️ You're sending messages too quickly. Please wait about {max(math.ceil(retry_after), 1)} seconds and try again."
 
 
 # ----------------------
@@ -387,20 +2211,10 @@ def signup():
             flash("choose strong password", "danger")
             return redirect(url_for("signup"))
 
-        if os.path.exists(USERS_FILE):
-            with open(USERS_FILE, "r") as f:
-                users = json.load(f)
-        else:
-            users = {}
-
-        if username in users:
+        if not user_store.create(username, generate_password_hash(password)):
             flash("Username already exists.", "danger")
             return redirect(url_for("signup"))
 
-        users[username] = generate_password_hash(password)
-        with open(USERS_FILE, "w") as f:
-            json.dump(users, f, indent=4)
-
         flash("Signup successful. Please log in.", "success")
         return redirect(url_for("login"))
 
@@ -420,15 +2234,10 @@ def login():
             flash("choose strong password", "danger")
             return redirect(url_for("login"))
 
-        if os.path.exists(USERS_FILE):
-            with open(USERS_FILE, "r") as f:
-                users = json.load(f)
-        else:
-            users = {}
-
-        if username in users and check_password_hash(users[username], password):
+        password_hash = user_store.get_password_hash(username)
+        if password_hash and check_password_hash(password_hash, password):
             session["username"] = username
-            session["chat_history"] = []
+            new_conversation()
             flash("Login successful!", "success")
             return redirect(url_for("chatbot"))
         else:
@@ -441,7 +2250,9 @@ def login():
 @app.route("/logout")
 def logout():
     session.pop("username", None)
-    session.pop("chat_history", None)
+    conversation_id = session.pop("conversation_id", None)
+    if conversation_id:
+        conversation_store.delete(conversation_id)
     flash("You have been logged out.", "info")
     return redirect(url_for("login"))
 
@@ -450,7 +2261,7 @@ def logout():
 def use_guest():
     session.pop("username", None)
     session["guest"] = True
-    session["chat_history"] = []
+    new_conversation()
     flash("You are now using chatbot as guest.", "info")
     return redirect(url_for("chatbot"))
 
@@ -475,9 +2286,473 @@ def env_check():
     return jsonify({
         "gemini_configured": has_key,
         "key_length": len(GEMINI_API_KEY) if GEMINI_API_KEY else 0,
+        "gemini_backend": GEMINI_BACKEND,
+        "gemini_client": gemini.status(),
+        "model_cache": model_registry.status(),
+        "answer_cache": answer_cache.status(),
+        "school_info": school_knowledge.status(),
+        "intent_router": school_knowledge.current().router.status(),
+        "chat_sessions": chat_session_pool.status(),
+        "single_flight": single_flight.status(),
+        "jobs": job_queue.status(),
+        "logging": {"level": LOG_LEVEL, "format": LOG_FORMAT, "dropped": log.handlers[0].dropped},
         "hint": "Redeploy after changing Environment variables on Render."
     })
 
+# ----------------------
+# Gemini AI Chat Helpers
+# ----------------------
+EMPTY_REPLY = "⚠️ Sorry, I'm facing a technical issue connecting to Gemini AI. Please try again."
+MISSING_KEY_REPLY = "⚠️ Error: Gemini API key is not configured. Set GEMINI_API_KEY in your environment (e.g. Render Dashboard → Environment)."
+
+# History sent with each turn is limited by an estimated token budget; older
+# turns are folded into a running summary, SUMMARY_BATCH_MESSAGES at a time.
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "1500"))
+HISTORY_MESSAGE_MAX_CHARS = HISTORY_TOKEN_BUDGET * 2  # one message may use at most half the budget
+SUMMARY_BATCH_MESSAGES = int(os.environ.get("SUMMARY_BATCH_MESSAGES", "6"))
+SUMMARY_MAX_WORDS = 150
+
+GENERATION_CONFIG = {
+    "temperature": 0.7,  # Balanced temperature for intelligent and professional responses
+    "top_p": 0.95,
+    "top_k": 40,
+}
+
+
+# The message sent for each turn is the question preceded by bracketed context:
+# the date and time, the running summary of older turns and the school info
+# relevant to the question. This is the hottest pure-Python path per message,
+# so the date/time line is formatted once a minute, school passages are
+# formatted once per school info version (SchoolKnowledge.passages), and the
+# message is assembled with a single join (benchmarks/bench_prompt.py).
+class PromptBuilder:
+    DATETIME_FORMAT = "[Current date and time: %A, %B %d, %Y, %I:%M %p (%Y-%m-%d %H:%M)]"
+    SUMMARY_OPEN = "\n[Summary of the earlier conversation: "
+    SCHOOL_OPEN = "\n[Relevant school info:\n"
+
+    def __init__(self, top_k=RETRIEVAL_TOP_K, clock=time.time):
+        self.top_k = top_k
+        self.clock = clock
+        self._datetime = (None, "")  # (minute, formatted line), replaced as one tuple
+
+    def datetime_context(self):
+        minute = int(self.clock() // 60)
+        cached_minute, line = self._datetime
+        if minute != cached_minute:
+            line = datetime.datetime.fromtimestamp(minute * 60).strftime(self.DATETIME_FORMAT)
+            self._datetime = (minute, line)
+        return line
+
+    def school_passages(self, user_message, messages, knowledge=None):
+        # Include the previous question so follow-ups like "what is her qualification?" still match
+        query = user_message
+        for msg in reversed(messages):
+            if msg.get("role") == "user":
+                query = f"{msg.get('content', '')} {user_message}"
+                break
+        return retrieve_passages(query, self.top_k, knowledge)
+
+    def build(self, user_message, conversation, knowledge=None):
+        """The full message for one turn of conversation."""
+        parts = [self.datetime_context()]
+        if conversation.summary:
+            parts += (self.SUMMARY_OPEN, conversation.summary, "]")
+        passages = self.school_passages(user_message, conversation.messages, knowledge)
+        if passages:
+            parts += (self.SCHOOL_OPEN, passages[0])
+            for passage in passages[1:]:
+                parts += ("\n\n", passage)
+            parts.append("]")
+        parts += ("\n\n", user_message)
+        return "".join(parts)
+
+
+prompt_builder = PromptBuilder()
+
+
+def estimate_tokens(text):
+    # ~4 characters per token is close enough for budgeting, and free (count_tokens is a network call)
+    return len(text) // 4 + 1
+
+
+def history_window(conversation):
+    """Return (history in Gemini's format, running summary) for a conversation.
+
+    The newest messages that fit HISTORY_TOKEN_BUDGET are sent as history; older
+    ones are represented by the running summary. Messages that fell out of the
+    window but are not summarised yet stay in it (at most one batch) until the
+    background summary catches up.
+    """
+    messages = conversation.messages
+    start, used = len(messages), 0
+    while start > 0:
+        cost = estimate_tokens(messages[start - 1].get("content", "")[:HISTORY_MESSAGE_MAX_CHARS])
+        if used + cost > HISTORY_TOKEN_BUDGET:
+            break
+        used += cost
+        start -= 1
+
+    summarized = min(max(conversation.summary_upto - conversation.offset, 0), len(messages))
+    if start > summarized:
+        if start - summarized >= SUMMARY_BATCH_MESSAGES:
+            schedule_summary(conversation, messages[summarized:start], conversation.offset + start)
+        start = max(summarized, start - SUMMARY_BATCH_MESSAGES + 1)
+    # Start the history on a user turn
+    if 0 < start < len(messages) and messages[start].get("role") == "assistant":
+        start -= 1
+
+    chat_history_for_gemini = []
+    for msg in messages[start:]:
+        role = msg.get("role", "")
+        content = msg.get("content", "")[:HISTORY_MESSAGE_MAX_CHARS]
+        if role == "user":
+            chat_history_for_gemini.append({"role": "user", "parts": [content]})
+        elif role == "assistant":
+            chat_history_for_gemini.append({"role": "model", "parts": [content]})
+    return chat_history_for_gemini, conversation.summary
+
+
+# Summaries are updated in a background thread so the user's reply never waits on it; at most
+# one summary update per conversation is in flight per worker.
+_summaries_in_flight = set()
+_summaries_lock = threading.Lock()
+
+
+def schedule_summary(conversation, new_messages, summary_upto):
+    with _summaries_lock:
+        if conversation.id in _summaries_in_flight:
+            return
+        _summaries_in_flight.add(conversation.id)
+    threading.Thread(
+        target=update_summary,
+        args=(conversation.id, conversation.summary, new_messages, summary_upto),
+        daemon=True,
+    ).start()
+
+
+def update_summary(conversation_id, previous_summary, new_messages, summary_upto):
+    """Fold new_messages into the conversation's running summary."""
+    transcript = "\n".join(
+        f"{'User' if m.get('role') == 'user' else 'Assistant'}: {m.get('content', '')[:HISTORY_MESSAGE_MAX_CHARS]}"
+        for m in new_messages
+    )
+    prompt = f"""Update the running summary of this conversation between a user and you (Ratna Chatbot).
+Keep names, facts, preferences and open questions that may matter later; drop greetings and small talk.
+Reply with the updated summary only, in at most {SUMMARY_MAX_WORDS} words.
+
+Current summary:
+{previous_summary or "(none yet)"}
+
+New messages:
+{transcript}"""
+    probe = False
+    try:
+        probe = upstream_health.check()
+        admission.admit("background")
+        model = model_registry.get()
+        started = time.perf_counter()
+        response = model.generate_content(prompt, generation_config=gemini.generation_config(temperature=0.2),
+                                          request_options=call_options())
+        metrics.observe("ratna_gemini_duration_seconds", time.perf_counter() - started, call="summary")
+        upstream_health.record_available()
+        summary = (response_text(response) or "").strip()
+        if summary:
+            conversation_store.set_summary(conversation_id, summary, summary_upto)
+    except UpstreamUnavailable:
+        pass  # try again on a later turn
+    except (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests) as rate_error:
+        upstream_health.record_rate_limit(retry_after_hint(rate_error))
+    except Exception as summary_error:
+        log.warning("Conversation summary failed: %s", summary_error, extra={"conversation_id": conversation_id})
+    finally:
+        if probe:
+            upstream_health.release_probe()
+        with _summaries_lock:
+            _summaries_in_flight.discard(conversation_id)
+
+
+# Live ChatSessions are kept per conversation (per worker) so a turn can reuse
+# the session instead of rebuilding it from stored history. A pooled session is
+# only reused while it still matches the stored conversation: same model, no
+# messages added elsewhere (e.g. by another worker), same summary, and within
+# CHAT_SESSION_MAX_TOKENS. Otherwise it is rebuilt from history_window.
+CHAT_SESSION_POOL_SIZE = int(os.environ.get("CHAT_SESSION_POOL_SIZE", "500"))
+CHAT_SESSION_IDLE_TIMEOUT = int(os.environ.get("CHAT_SESSION_IDLE_TIMEOUT", "900"))
+CHAT_SESSION_MAX_TOKENS = HISTORY_TOKEN_BUDGET * 2
+
+PooledChat = namedtuple("PooledChat", ["chat", "model", "total", "summary_upto", "tokens", "last_used"])
+
+
+class ChatSessionPool:
+    def __init__(self, max_size=CHAT_SESSION_POOL_SIZE, idle_timeout=CHAT_SESSION_IDLE_TIMEOUT,
+                 max_tokens=CHAT_SESSION_MAX_TOKENS):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # conversation id -> PooledChat
+        self.stats = {"reused": 0, "rebuilt": 0, "stale": 0, "evicted": 0}
+
+    def checkout(self, conversation, model):
+        """Take the conversation's session out of the pool if it can be reused, else None.
+
+        While checked out the session is not in the pool, so two concurrent turns of
+        one conversation never share a ChatSession.
+        """
+        with self._lock:
+            pooled = self._sessions.pop(conversation.id, None)
+            if pooled is None:
+                self.stats["rebuilt"] += 1
+                return None
+            if (pooled.model is not model
+                    or pooled.total != conversation.offset + len(conversation.messages)
+                    or pooled.summary_upto != conversation.summary_upto
+                    or pooled.tokens > self.max_tokens
+                    or time.monotonic() - pooled.last_used > self.idle_timeout):
+                self.stats["stale"] += 1
+                self.stats["rebuilt"] += 1
+                return None
+            self.stats["reused"] += 1
+            return pooled
+
+    def checkin(self, conversation, model, chat, tokens):
+        """Return a session after a successful turn (the turn's two messages are about to be saved)."""
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[conversation.id] = PooledChat(
+                chat, model, conversation.offset + len(conversation.messages) + 2,
+                conversation.summary_upto, tokens, now)
+            # Oldest-used sessions are at the front
+            while self._sessions:
+                oldest = next(iter(self._sessions.values()))
+                if len(self._sessions) <= self.max_size and now - oldest.last_used <= self.idle_timeout:
+                    break
+                self._sessions.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def status(self):
+        with self._lock:
+            return {"size": len(self._sessions), **self.stats}
+
+
+chat_session_pool = ChatSessionPool()
+
+
+def open_chat(model, conversation):
+    """Return (ChatSession, estimated history tokens), reusing the pooled session when possible."""
+    pooled = chat_session_pool.checkout(conversation, model)
+    if pooled is not None:
+        return pooled.chat, pooled.tokens
+    chat_history_for_gemini, _ = history_window(conversation)
+    tokens = sum(estimate_tokens(part) for msg in chat_history_for_gemini for part in msg["parts"])
+    return model.start_chat(history=chat_history_for_gemini), tokens
+
+
+def strip_turn_context(chat, user_message):
+    """Replace the turn just sent in the chat's history with the bare user message; returns its tokens.
+
+    The date, summary and school passages only apply to the turn they were sent with.
+    Dropping them keeps a pooled session's history the same as the one history_window
+    would rebuild, so the model sees the same context whichever worker answers.
+    """
+    content = user_message[:HISTORY_MESSAGE_MAX_CHARS]
+    history = chat.history
+    history[-2] = {"role": "user", "parts": [content]}
+    chat.history = history
+    return estimate_tokens(content)
+
+
+def response_text(response):
+    # Prefer response.text when available; otherwise attempt to read from candidates
+    try:
+        text = response.text
+    except Exception:
+        # .text raises when a (streamed) response has no text parts
+        text = None
+    if not text:
+        try:
+            first_candidate = response.candidates[0]
+            # Some SDK versions return parts list; join text parts if present
+            parts = getattr(first_candidate, "content", None)
+            if parts and hasattr(parts, "parts"):
+                text_parts = [getattr(p, "text", "") for p in parts.parts]
+                text = "".join(text_parts).strip() or None
+        except Exception:
+            text = None
+    return text
+
+
+def log_token_usage(usage, message):
+    """Log Gemini's token usage next to the size of the per-turn message.
+
+    The per-turn message used to carry all of the school info (~school_info_tokens);
+    it now carries only the retrieved chunks.
+    """
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0)
+    response_tokens = getattr(usage, "candidates_token_count", 0)
+    metrics.inc("ratna_gemini_tokens_total", prompt_tokens or 0, kind="prompt")
+    metrics.inc("ratna_gemini_tokens_total", response_tokens or 0, kind="response")
+    token_log.info("Gemini token usage", extra={
+        "prompt_tokens": prompt_tokens, "response_tokens": response_tokens,
+        "turn_message_tokens": len(message) // 4, "school_info_tokens": school_knowledge.current().tokens})
+
+
+def generate_reply(model, user_message, conversation, stream=False, priority="user"):
+    """Yield reply text from Gemini, one piece per streamed chunk (or once when not streaming).
+
+    Model failover is retried only until the first piece has been yielded, since a partially
+    delivered reply cannot be taken back. Rate limits are never waited out here; they are
+    reported to upstream_health, which fails fast while Gemini is over quota. priority
+    ("user" or "guest") decides who is shed first when the quota runs low.
+    """
+    # The persona is the model's system_instruction; only the date/time, relevant school info
+    # and the summary of older turns go per turn
+    full_message = prompt_builder.build(user_message, conversation)
+    generation_config = gemini.generation_config(**GENERATION_CONFIG)
+
+    # One quota token per turn; failover retries below don't take another
+    admission.admit(priority)
+    deadline = time.monotonic() + GEMINI_DEADLINE
+
+    # Reuse (or rebuild) the conversation's chat session for better memory
+    max_retries = 3
+
+    for attempt in range(max_retries):
+        probe = upstream_health.check()
+        yielded = False
+        try:
+            # A session that fails mid-turn is simply not returned to the pool
+            chat, history_tokens = open_chat(model, conversation)
+            log_context(model=getattr(model, "model_name", None))
+            started = time.perf_counter()
+            response = chat.send_message(full_message, generation_config=generation_config, stream=stream,
+                                         request_options=call_options(deadline))
+            usage = None
+            reply_tokens = 0
+            for chunk in (response if stream else [response]):
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                text = response_text(chunk)
+                if text:
+                    yielded = True
+                    reply_tokens += estimate_tokens(text)
+                    yield text
+            metrics.observe("ratna_gemini_duration_seconds", time.perf_counter() - started,
+                            call="stream" if stream else "chat")
+            log_token_usage(usage, full_message)
+            # Success - keep the session for the next turn and leave the retry loop
+            upstream_health.record_available()
+            chat_session_pool.checkin(conversation, model, chat, history_tokens + strip_turn_context(chat, user_message) + reply_tokens)
+            return
+        except (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests) as rate_error:
+            upstream_health.record_rate_limit(retry_after_hint(rate_error))
+            raise
+        except (google_exceptions.NotFound, google_exceptions.PermissionDenied) as model_error:
+            # The cached model was removed or lost access; fail over to the next candidate
+            upstream_health.record_available()
+            if yielded:
+                raise
+            log.warning("Model error, failing over: %s", model_error, extra={"attempt": attempt + 1})
+            model = model_registry.failover(model)
+            if model is None or attempt == max_retries - 1:
+                raise
+            metrics.inc("ratna_gemini_retries_total")
+            log_context(retries=attempt + 1)
+        except Exception as api_error:
+            upstream_health.record_available()
+            # Tracebacks only at LOG_LEVEL=DEBUG; the endpoint logs the categorised error
+            log.debug("Gemini call failed: %s", api_error, exc_info=True)
+            # Re-raise to be caught by the endpoint's exception handler
+            raise
+        finally:
+            # A /stream client that disconnects closes this generator (GeneratorExit) before
+            # either verdict is recorded; don't leave the half-open probe claimed
+            if probe:
+                upstream_health.release_probe()
+
+
+def gemini_error_reply(e):
+    """Map an exception from the Gemini call to the reply shown to the user."""
+    if isinstance(e, UpstreamUnavailable):
+        # Expected while the circuit is open; not worth logging per request
+        metrics.inc("ratna_chat_errors_total", category="busy")
+        return f"⚠️ Ratna Chatbot is receiving too many questions right now. Please try again in about {max(int(e.retry_after), 1)} seconds."
+
+    error_msg = str(e)
+
+    # Check for specific Google API exceptions
+    is_quota_error = (
+        isinstance(e, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)) or
+        "quota" in error_msg.lower() or
+        "rate limit" in error_msg.lower() or
+        "resource exhausted" in error_msg.lower() or
+        "429" in error_msg
+    )
+
+    # Provide more specific error messages based on error type
+    if isinstance(e, google_exceptions.DeadlineExceeded):
+        category, reply = "timeout", "⚠️ Gemini AI took too long to answer. Please try again."
+    elif "API_KEY" in error_msg or "api key" in error_msg.lower() or isinstance(e, google_exceptions.Unauthenticated):
+        category, reply = "api_key", "⚠️ Error: Invalid or missing Gemini API key. Set GEMINI_API_KEY in Render Dashboard → Environment and redeploy."
+    elif is_quota_error:
+        category, reply = "quota", "⚠️ Error: API quota exceeded or rate limit reached. Please wait a few moments and try again. If this persists, you may need to upgrade your API plan or wait for your quota to reset."
+    elif "model" in error_msg.lower() or isinstance(e, google_exceptions.NotFound):
+        category, reply = "model", "⚠️ Error: Model not available. Please check your API access."
+    elif isinstance(e, google_exceptions.PermissionDenied):
+        category, reply = "permission", "⚠️ Error: Permission denied. Please check your API key permissions."
+    else:
+        category, reply = "other", f"⚠️ Sorry, I'm facing a technical issue: {error_msg[:100]}. Please try again."
+    metrics.inc("ratna_chat_errors_total", category=category)
+    log.warning("Gemini API error: %s", error_msg, extra={"error_type": type(e).__name__, "category": category})
+    return reply
+
+
+def get_model_or_reply():
+    """Return (model, None) from the registry, or (None, error_reply) when no model is usable."""
+    try:
+        return model_registry.get(), None
+    except ModelUnavailable as unavailable:
+        metrics.inc("ratna_chat_errors_total", category="model")
+        return None, f"⚠️ Error: {str(unavailable)}"
+    except Exception as list_error:
+        log.error("Error listing/initializing models: %s", list_error, exc_info=True)
+        metrics.inc("ratna_chat_errors_total", category="model")
+        return None, f"⚠️ Error: Unable to access Gemini models. Error: {str(list_error)}. Please verify your API key and model access."
+
+
+def save_chat_turn(conversation_id, user_message, bot_reply):
+    conversation_store.append(conversation_id, [
+        {"role": "user", "content": user_message},
+        {"role": "assistant", "content": bot_reply},
+    ])
+
+
+def gemini_turn(model, user_message, conversation, knowledge, priority="user"):
+    """Answer one turn with Gemini (not streamed); errors become the reply shown to the user.
+
+    First-turn answers are shared between identical concurrent questions and cached.
+    """
+    first_turn = not conversation.messages
+    try:
+        if first_turn:
+            # Identical first questions asked at the same moment share one Gemini call
+            bot_reply = single_flight.do(
+                normalize_query(user_message),
+                lambda: "".join(generate_reply(model, user_message, conversation, priority=priority)))
+        else:
+            bot_reply = "".join(generate_reply(model, user_message, conversation, priority=priority))
+        if not bot_reply:
+            log.warning("Empty response from Gemini API")
+            metrics.inc("ratna_chat_errors_total", category="empty")
+            bot_reply = EMPTY_REPLY
+        elif first_turn:
+            answer_cache.put(user_message, bot_reply, knowledge.version)
+    except Exception as e:
+        bot_reply = gemini_error_reply(e)
+    return bot_reply
+
+
 # ----------------------
 # Gemini AI Chat Endpoint
 # ----------------------
@@ -490,244 +2765,672 @@ def get_bot_response():
     if not user_message:
         return jsonify({"reply": "Please enter a message."})
 
-    # Short, polite replies for very simple greetings (avoid long AI answers)
-    simple_greetings = {
-        "hi", "hi.", "hi!", "hello", "hello.", "hello!",
-        "hey", "hey.", "hey!", "namaste", "namaste.", "namaste!",
-        "good morning", "good morning.", "good morning!",
-        "good afternoon", "good afternoon.", "good afternoon!",
-        "good evening", "good evening.", "good evening!"
-    }
-    if user_message.lower() in simple_greetings:
-        bot_reply = "Hello! How can I help you today?"
+    conversation_id = current_conversation_id()
 
-        # Save chat history and return immediately without calling Gemini
-        chat_history = session.get("chat_history", [])
-        chat_history.append({"role": "user", "content": user_message})
-        chat_history.append({"role": "assistant", "content": bot_reply})
-        session["chat_history"] = chat_history
+    retry_after = rate_limit_retry_after(conversation_id)
+    if retry_after:
+        return jsonify({"reply": rate_limited_reply(retry_after)}), 429, {"Retry-After": str(math.ceil(retry_after))}
 
-        return jsonify({"reply": bot_reply})
+    # One school info snapshot for the whole turn, even if the file is reloaded meanwhile
+    knowledge = school_knowledge.current()
 
-    try:
-        # Get current date and time
-        current_datetime = datetime.datetime.now()
-        current_date = current_datetime.strftime("%B %d, %Y")  # e.g., "January 15, 2024"
-        current_time = current_datetime.strftime("%I:%M %p")  # e.g., "02:30 PM"
-        current_day = current_datetime.strftime("%A")  # e.g., "Monday"
-        current_datetime_full = current_datetime.strftime("%Y-%m-%d %H:%M:%S")
+    # Greetings and structured school questions are answered locally without calling Gemini
+    local = knowledge.router.route(user_message)
+    if local is not None:
+        metrics.inc("ratna_local_replies_total", intent=local.intent)
+        save_chat_turn(conversation_id, user_message, local.reply)
+        return jsonify({"reply": local.reply})
 
+    try:
         # Check if API key is configured
-        if not GEMINI_API_KEY:
-            return jsonify({"reply": "⚠️ Error: Gemini API key is not configured. Set GEMINI_API_KEY in your environment (e.g. Render Dashboard → Environment)."})
+        if not GEMINI_READY:
+            return jsonify({"reply": MISSING_KEY_REPLY})
 
         # Get conversation history for context and memory
-        chat_history = session.get("chat_history", [])
-
-        # First, list available models to find one that actually works
-        model = None
-        try:
-            print("Listing available models...")
-            all_models = list(genai.list_models())
-            print(f"Total models found: {len(all_models)}")
-            
-            # Find models that support generateContent
-            available_models = []
-            for m in all_models:
-                methods = getattr(m, 'supported_generation_methods', [])
-                if 'generateContent' in methods:
-                    model_name = m.name
-                    available_models.append(model_name)
-                    print(f"  ✓ {model_name} (supports generateContent)")
-            
-            if not available_models:
-                return jsonify({"reply": "⚠️ Error: No models with generateContent support found. Please check your API key and access permissions."})
-            
-            # Try each available model until one works
-            for avail_model in available_models:
-                # Try with the model name as-is first (might include "models/" prefix)
-                try:
-                    print(f"Attempting to use model: {avail_model}")
-                    model = genai.GenerativeModel(avail_model)
-                    print(f"✓ Successfully initialized model: {avail_model}")
-                    break
-                except Exception as model_error:
-                    print(f"✗ Model {avail_model} failed: {str(model_error)}")
-                    # Try extracting just the model ID (remove "models/" prefix)
-                    if "/" in avail_model:
-                        model_id = avail_model.split("/")[-1]
-                        try:
-                            print(f"  Trying with model ID only: {model_id}")
-                            model = genai.GenerativeModel(model_id)
-                            print(f"✓ Successfully initialized model: {model_id}")
-                            break
-                        except Exception as id_error:
-                            print(f"✗ Model ID {model_id} also failed: {str(id_error)}")
-                    continue
-            
-            if model is None:
-                return jsonify({"reply": f"⚠️ Error: Found {len(available_models)} models but none could be used. Please check your API key permissions."})
-                
-        except Exception as list_error:
-            import traceback
-            error_details = traceback.format_exc()
-            print(f"Error listing/initializing models: {error_details}")
-            return jsonify({"reply": f"⚠️ Error: Unable to access Gemini models. Error: {str(list_error)}. Please verify your API key and model access."})
-
-        # Enhanced system prompt for better intelligence and memory
-        system_instruction = f"""You are Ratna Chatbot — an intelligent and helpful AI assistant for Shree Ratna Rajya Laxmi Secondary School, Kathmandu. You have excellent memory and can handle both school-related and general questions with intelligence and professionalism.
-
-School info:
-{SCHOOL_INFO}
-
-Current Date and Time Information:
-- Today's date: {current_date}
-- Current day: {current_day}
-- Current time: {current_time}
-- Full datetime: {current_datetime_full}
+        conversation = conversation_store.get_state(conversation_id)
+        first_turn = not conversation.messages
 
-Your personality and capabilities:
-- You are intelligent, knowledgeable, and can answer general questions about science, history, geography, current events, technology, culture, and more with depth and accuracy.
-- You remember previous parts of the conversation and can reference earlier topics naturally.
-- You provide thoughtful, well-reasoned answers to complex questions.
-- You can engage in friendly discussions, explain concepts clearly, and adapt your communication style to the user's needs.
+        # First-turn questions don't depend on history, so they can be answered from the cache
+        cached_reply = answer_cache.get(user_message, knowledge.version) if first_turn else None
+        if cached_reply is not None:
+            save_chat_turn(conversation_id, user_message, cached_reply)
+            return jsonify({"reply": cached_reply})
 
-Your tasks:
-- Answer questions about the school (principal, fees, exams, events, contact info, classes, etc.) with detailed and accurate information.
-- Handle general knowledge questions intelligently — provide comprehensive, accurate answers with examples when helpful.
-- Reply naturally to casual chat (greetings, small talk, etc.) with warmth and professionalism.
-- When asked about time, date, or "what time is it", "what date is it", "what day is it", provide the current date and time information from above.
-- Remember and reference previous conversation topics when relevant to show continuity and memory.
-- If asked about something you don't know, admit it honestly but offer to help find related information.
-- Keep responses conversational, engaging, and informative while maintaining a professional tone.
-
-Guidelines:
-- Be friendly, approachable, and professional.
-- Use emojis sparingly and appropriately (😊, 🎓, 📚, etc.) when suitable.
-- Vary your response style — sometimes be more formal, sometimes more casual, depending on the question.
-- Show genuine interest in helping and engaging with the user.
-- Maintain a professional and helpful demeanor."""
-
-        # Build conversation history for Gemini's chat API
-        chat_history_for_gemini = []
-        if chat_history:
-            # Convert session history to Gemini's format (last 20 messages for better context)
-            recent_history = chat_history[-20:] if len(chat_history) > 20 else chat_history
-            for msg in recent_history:
-                role = msg.get("role", "")
-                content = msg.get("content", "")
-                if role == "user":
-                    chat_history_for_gemini.append({"role": "user", "parts": [content]})
-                elif role == "assistant":
-                    chat_history_for_gemini.append({"role": "model", "parts": [content]})
-
-        # Verify model is initialized before using it
-        if model is None:
-            return jsonify({"reply": "⚠️ Error: Model initialization failed. Please check the console for details."})
-
-        # Start a chat session with history for better memory
-        # Add retry logic for rate limits
-        # Start a chat session with history for better memory
-        # Add retry logic for rate limits
-        max_retries = 3
-        retry_delay = 2  # seconds
-        response = None
-        
-        for attempt in range(max_retries):
+        if request.args.get("mode") == "job":
+            # Answered in the background; the client polls /result/<job_id>
             try:
-                if chat_history_for_gemini:
-                    chat = model.start_chat(history=chat_history_for_gemini)
-                    # Combine system instruction with user message for better context
-                    full_message = f"{system_instruction}\n\nUser's current message: {user_message}\n\nProvide a helpful, intelligent, and engaging response:"
-                    response = chat.send_message(
-                        full_message,
-                        generation_config=genai.types.GenerationConfig(
-                            temperature=0.7,  # Balanced temperature for intelligent and professional responses
-                            top_p=0.95,
-                            top_k=40,
-                        )
-                    )
-                else:
-                    # First message - no history yet
-                    response = model.generate_content(
-                        f"{system_instruction}\n\nUser's current message: {user_message}\n\nProvide a helpful, intelligent, and engaging response:",
-                        generation_config=genai.types.GenerationConfig(
-                            temperature=0.7,
-                            top_p=0.95,
-                            top_k=40,
-                        )
-                    )
-                # Success - break out of retry loop
-                break
-            except (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests) as rate_error:
-                if attempt < max_retries - 1:
-                    wait_time = retry_delay * (2 ** attempt)  # Exponential backoff
-                    print(f"⚠️ Rate limit hit. Retrying in {wait_time} seconds... (Attempt {attempt + 1}/{max_retries})")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    # Last attempt failed
-                    raise
-            except Exception as api_error:
-                error_msg = str(api_error)
-                print(f"⚠️ API Call Error: {error_msg}")
-                print(f"Error type: {type(api_error).__name__}")
-                import traceback
-                print(f"Traceback: {traceback.format_exc()}")
-                # Re-raise to be caught by outer exception handler
-                raise
-        # Prefer response.text when available; otherwise attempt to read from candidates
-        bot_reply = getattr(response, "text", None)
-        if not bot_reply:
-            try:
-                first_candidate = response.candidates[0]
-                # Some SDK versions return parts list; join text parts if present
-                parts = getattr(first_candidate, "content", None)
-                if parts and hasattr(parts, "parts"):
-                    text_parts = [getattr(p, "text", "") for p in parts.parts]
-                    bot_reply = "".join(text_parts).strip() or None
-            except Exception:
-                bot_reply = None
-        if not bot_reply:
-            print("⚠️ Warning: Empty response from Gemini API")
-            bot_reply = "⚠️ Sorry, I'm facing a technical issue connecting to Gemini AI. Please try again."
+                job_id = job_queue.submit(conversation_id, user_message, request_priority())
+            except JobQueueFull:
+                return jsonify({"reply": JOB_QUEUE_FULL_REPLY}), 503, {"Retry-After": str(JOB_POLL_MAX_WAIT)}
+            return jsonify({"job_id": job_id, "status": "queued",
+                            "result_url": url_for("job_result", job_id=job_id)}), 202
+
+        # Use the per-worker cached model instead of listing models on every request
+        model, error_reply = get_model_or_reply()
+        if model is None:
+            return jsonify({"reply": error_reply})
+
+        bot_reply = gemini_turn(model, user_message, conversation, knowledge, request_priority())
 
     except Exception as e:
-        # Log the actual error for debugging
-        error_msg = str(e)
-        error_type = type(e).__name__
-        print(f"⚠️ Gemini API Error: {error_msg}")
-        print(f"Error type: {error_type}")
-        
-        # Check for specific Google API exceptions
-        is_quota_error = (
-            isinstance(e, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)) or
-            "quota" in error_msg.lower() or 
-            "rate limit" in error_msg.lower() or
-            "resource exhausted" in error_msg.lower() or
-            "429" in error_msg
-        )
-        
-        # Provide more specific error messages based on error type
-        if "API_KEY" in error_msg or "api key" in error_msg.lower() or isinstance(e, google_exceptions.Unauthenticated):
-            bot_reply = "⚠️ Error: Invalid or missing Gemini API key. Set GEMINI_API_KEY in Render Dashboard → Environment and redeploy."
-        elif is_quota_error:
-            bot_reply = "⚠️ Error: API quota exceeded or rate limit reached. Please wait a few moments and try again. If this persists, you may need to upgrade your API plan or wait for your quota to reset."
-        elif "model" in error_msg.lower() or isinstance(e, google_exceptions.NotFound):
-            bot_reply = "⚠️ Error: Model not available. Please check your API access."
-        elif isinstance(e, google_exceptions.PermissionDenied):
-            bot_reply = "⚠️ Error: Permission denied. Please check your API key permissions."
-        else:
-            bot_reply = f"⚠️ Sorry, I'm facing a technical issue: {error_msg[:100]}. Please try again."
+        bot_reply = gemini_error_reply(e)
 
     # Save chat history
-    chat_history = session.get("chat_history", [])
-    chat_history.append({"role": "user", "content": user_message})
-    chat_history.append({"role": "assistant", "content": bot_reply})
-    session["chat_history"] = chat_history
+    save_chat_turn(conversation_id, user_message, bot_reply)
 
     return jsonify({"reply": bot_reply})
 
+# ----------------------
+# Streaming Chat Endpoint (Server-Sent Events)
+# ----------------------
+
+def sse_event(data, event=None):
+    payload = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+
+def sse_response(events, status=200, headers=None):
+    return Response(events, status=status, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # stop proxies from buffering the stream
+        **(headers or {}),
+    })
+
+
+def sse_reply(bot_reply, status=200, headers=None):
+    """A stream holding just the final reply, for answers known without calling Gemini."""
+    return sse_response([sse_event({"reply": bot_reply}, event="done")], status, headers)
+
+
+@app.route("/stream", methods=["GET"])
+def stream_bot_response():
+    if "username" not in session and "guest" not in session:
+        return sse_reply("Access denied. Please log in or use as guest.")
+
+    user_message = request.args.get("msg", "").strip()
+    if not user_message:
+        return sse_reply("Please enter a message.")
+
+    # Resolve the conversation before streaming starts so the cookie is set
+    conversation_id = current_conversation_id()
+
+    retry_after = rate_limit_retry_after(conversation_id)
+    if retry_after:
+        return sse_reply(rate_limited_reply(retry_after), 429, {"Retry-After": str(math.ceil(retry_after))})
+
+    knowledge = school_knowledge.current()
+    local = knowledge.router.route(user_message)
+    if local is not None:
+        metrics.inc("ratna_local_replies_total", intent=local.intent)
+        save_chat_turn(conversation_id, user_message, local.reply)
+        return sse_reply(local.reply)
+
+    if not GEMINI_READY:
+        return sse_reply(MISSING_KEY_REPLY)
+
+    conversation = conversation_store.get_state(conversation_id)
+    first_turn = not conversation.messages
+
+    cached_reply = answer_cache.get(user_message, knowledge.version) if first_turn else None
+    if cached_reply is not None:
+        save_chat_turn(conversation_id, user_message, cached_reply)
+        return sse_reply(cached_reply)
+
+    model, error_reply = get_model_or_reply()
+    if model is None:
+        return sse_reply(error_reply)
+
+    # Identical first questions streaming at the same moment share one Gemini call:
+    # the leader streams it, the others receive the finished reply in one piece
+    flight_key = normalize_query(user_message) if first_turn else None
+    priority = request_priority()
+
+    def events():
+        pieces = []
+        bot_reply = None
+        # Joined here rather than in the view so a stream that never starts can't strand a flight
+        flight, leader = single_flight.join(flight_key) if flight_key else (None, True)
+        try:
+            if not leader:
+                bot_reply = single_flight.wait(flight)
+                if bot_reply is not None:
+                    metrics.inc("ratna_single_flight_shared_total")
+            if bot_reply is None:
+                for text in generate_reply(model, user_message, conversation, stream=True, priority=priority):
+                    pieces.append(text)
+                    yield sse_event({"text": text})
+                bot_reply = "".join(pieces)
+            if leader and flight:
+                # The raw reply: followers must not take EMPTY_REPLY for an answer and cache it
+                single_flight.complete(flight_key, flight, result=bot_reply)
+            if not bot_reply:
+                log.warning("Empty response from Gemini API")
+                metrics.inc("ratna_chat_errors_total", category="empty")
+                bot_reply = EMPTY_REPLY
+            elif first_turn:
+                answer_cache.put(user_message, bot_reply, knowledge.version)
+        except Exception as e:
+            if leader and flight:
+                single_flight.complete(flight_key, flight, error=e)
+            bot_reply = gemini_error_reply(e)
+        finally:
+            # A client that disconnects mid-stream must not leave followers waiting;
+            # with nothing to share they make their own call
+            if leader and flight and not flight.done.is_set():
+                single_flight.complete(flight_key, flight)
+        save_chat_turn(conversation_id, user_message, bot_reply)
+        yield sse_event({"reply": bot_reply}, event="done")
+
+    return sse_response(stream_with_context(events()))
+
+# ----------------------
+# Batch Chat Endpoint
+# ----------------------
+# POST /batch answers many questions in one round trip (the notice-board kiosk,
+# the LMS integration). The JSON body is {"messages": [...]}, each message a
+# string or {"msg": ..., "conversation_id": ...}. A message without a
+# conversation id starts a new conversation, whose id is returned with the
+# reply; messages sharing a conversation are answered in order. Each message
+# counts against the client rate limits like one /get request, charged up front
+# for the whole batch, so BATCH_MAX_MESSAGES should not exceed the burst of
+# RATE_LIMIT_SESSION (20 by default). Local intent replies
+# and cached answers are resolved straight away, then the remaining
+# conversations go to Gemini concurrently on a per-worker pool of BATCH_WORKERS
+# threads, each call still admitted against GEMINI_QUOTA. Results keep the order
+# of the messages: a JSON array, or with ?format=ndjson (or Accept:
+# application/x-ndjson) one JSON line per message, sent as soon as it and every
+# message before it are answered.
+BATCH_MAX_MESSAGES = int(os.environ.get("BATCH_MAX_MESSAGES", "20"))
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "4"))
+CONVERSATION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+
+
+def parse_batch(data):
+    """Return [(message, conversation id or None)] from a /batch body; raises ValueError."""
+    messages = data.get("messages") if isinstance(data, dict) else None
+    if not isinstance(messages, list) or not messages:
+        raise ValueError('Expected a JSON object with a non-empty "messages" list.')
+    if len(messages) > BATCH_MAX_MESSAGES:
+        raise ValueError(f"At most {BATCH_MAX_MESSAGES} messages per batch.")
+    items = []
+    for item in messages:
+        if isinstance(item, str):
+            item = {"msg": item}
+        if not isinstance(item, dict) or not isinstance(item.get("msg", ""), str):
+            raise ValueError('Each message must be a string or an object with a "msg" string.')
+        conversation_id = item.get("conversation_id")
+        if conversation_id is not None and not (
+                isinstance(conversation_id, str) and CONVERSATION_ID_PATTERN.fullmatch(conversation_id)):
+            raise ValueError(f"Invalid conversation_id: {conversation_id!r}")
+        items.append((item.get("msg", "").strip(), conversation_id))
+    return items
+
+
+def batch_result(conversation_id, reply, source):
+    metrics.inc("ratna_batch_messages_total", source=source)
+    return {"conversation_id": conversation_id, "reply": reply, "source": source}
+
+
+def batch_conversation(conversation_id, turns, model, knowledge, priority):
+    """Answer one conversation's batch messages in order, so each turn sees the replies before it.
+
+    turns is [(index, message, conversation state or None to read it from the store)].
+    """
+    results = []
+    for index, user_message, conversation in turns:
+        local = knowledge.router.route(user_message) if conversation is None else None
+        if local is not None:
+            metrics.inc("ratna_local_replies_total", intent=local.intent)
+            bot_reply, source = local.reply, "local"
+        else:
+            conversation = conversation or conversation_store.get_state(conversation_id)
+            # The same question may have been answered earlier in the batch while this one was queued
+            cached_reply = answer_cache.get(user_message, knowledge.version) if not conversation.messages else None
+            if cached_reply is not None:
+                bot_reply, source = cached_reply, "cache"
+            else:
+                bot_reply, source = gemini_turn(model, user_message, conversation, knowledge, priority), "gemini"
+        save_chat_turn(conversation_id, user_message, bot_reply)
+        results.append((index, batch_result(conversation_id, bot_reply, source)))
+    return results
+
+
+@app.route("/batch", methods=["POST"])
+def batch_bot_response():
+    if "username" not in session and "guest" not in session:
+        return jsonify({"status": "error", "message": "Access denied. Please log in or use as guest."}), 401
+    try:
+        items = parse_batch(request.get_json(silent=True))
+    except ValueError as invalid:
+        return jsonify({"status": "error", "message": str(invalid)}), 400
+
+    retry_after = rate_limit_retry_after(current_conversation_id(), cost=len(items))
+    if retry_after:
+        return (jsonify({"status": "error", "message": rate_limited_reply(retry_after)}), 429,
+                {"Retry-After": str(math.ceil(retry_after))})
+
+    knowledge = school_knowledge.current()
+    results = [None] * len(items)
+    pending = OrderedDict()  # conversation id -> turns left for Gemini, in message order
+
+    for index, (user_message, conversation_id) in enumerate(items):
+        new = conversation_id is None
+        conversation_id = conversation_id or uuid.uuid4().hex
+        if not user_message:
+            results[index] = batch_result(conversation_id, "Please enter a message.", "invalid")
+            continue
+        if conversation_id in pending:
+            # Answered after the earlier message of its conversation
+            pending[conversation_id].append((index, user_message, None))
+            continue
+        local = knowledge.router.route(user_message)
+        if local is not None:
+            metrics.inc("ratna_local_replies_total", intent=local.intent)
+            save_chat_turn(conversation_id, user_message, local.reply)
+            results[index] = batch_result(conversation_id, local.reply, "local")
+            continue
+        if not GEMINI_READY:
+            results[index] = batch_result(conversation_id, MISSING_KEY_REPLY, "error")
+            continue
+        conversation = ConversationState(conversation_id, [], 0, "", 0) if new else conversation_store.get_state(conversation_id)
+        cached_reply = answer_cache.get(user_message, knowledge.version) if not conversation.messages else None
+        if cached_reply is not None:
+            save_chat_turn(conversation_id, user_message, cached_reply)
+            results[index] = batch_result(conversation_id, cached_reply, "cache")
+            continue
+        pending[conversation_id] = [(index, user_message, conversation)]
+
+    futures = {}
+    if pending:
+        model, error_reply = get_model_or_reply()
+        priority = request_priority()
+        request_id = g.get("request_id")
+
+        def answer(conversation_id, turns):
+            log_context(request_id=request_id)
+            return batch_conversation(conversation_id, turns, model, knowledge, priority)
+
+        for conversation_id, turns in pending.items():
+            if model is None:
+                for index, _, _ in turns:
+                    results[index] = batch_result(conversation_id, error_reply, "error")
+                continue
+            # Each task gets its own copy of the request context, for the session and log fields
+            future = batch_executor.submit(copy_current_request_context(answer), conversation_id, turns)
+            for index, _, _ in turns:
+                futures[index] = future
+
+    def ordered_results():
+        for index in range(len(results)):
+            if results[index] is None:
+                for answered, result in futures[index].result():
+                    results[answered] = result
+            yield results[index]
+
+    if request.args.get("format") == "ndjson" or request.accept_mimetypes.best == "application/x-ndjson":
+        return Response(stream_with_context(json.dumps(result) + "\n" for result in ordered_results()),
+                        mimetype="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+    return jsonify(list(ordered_results()))
+
+# ----------------------
+# Chat Jobs (job mode)
+# ----------------------
+# A slow Gemini reply can outlast Render's proxy timeout, and the browser then
+# gets nothing although the worker finishes the turn. With /get?mode=job the
+# turn is queued instead and the client gets a job id straight away, then
+# long-polls /result/<job_id> (up to JOB_POLL_MAX_WAIT seconds per poll) until
+# the reply is there; DELETE /result/<job_id> cancels it. Each worker runs up
+# to JOB_WORKERS jobs on its own threads, never on HTTP threads. With the
+# default JOB_STORE=sqlite the queue lives in JOBS_DB, so any worker can
+# answer a poll, and jobs claimed by a worker that died are picked up again
+# once its lease runs out. JOB_STORE=memory keeps the queue per process (for a
+# single worker). At most JOB_QUEUE_DEPTH jobs wait at once; a job not started
+# within JOB_DEADLINE seconds expires, and one nobody polled for
+# JOB_ABANDON_AFTER seconds is cancelled before it starts.
+JOB_STORE = os.environ.get("JOB_STORE", "sqlite").lower()
+JOBS_DB = os.environ.get("JOBS_DB", os.path.join(os.path.dirname(__file__), "jobs.db"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "8"))
+JOB_QUEUE_DEPTH = int(os.environ.get("JOB_QUEUE_DEPTH", "100"))
+JOB_DEADLINE = float(os.environ.get("JOB_DEADLINE", "120"))
+JOB_ABANDON_AFTER = float(os.environ.get("JOB_ABANDON_AFTER", "30"))
+JOB_POLL_MAX_WAIT = int(os.environ.get("JOB_POLL_MAX_WAIT", "25"))
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", "600"))
+JOB_LEASE = 15  # seconds a claimed job stays with its worker without a heartbeat
+JOB_DISPATCH_INTERVAL = 1.0  # how often idle workers look for jobs queued by other workers
+JOB_FINAL_STATUSES = ("done", "failed", "expired", "cancelled")
+JOB_QUEUE_FULL_REPLY = "⚠️ Ratna Chatbot has too many questions waiting right now. Please try again shortly."
+
+Job = namedtuple("Job", ["id", "conversation_id", "message", "priority", "status", "reply", "created", "deadline", "polled"])
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class MemoryJobStore:
+    """Jobs in this process only; polls must reach the worker that queued the job."""
+
+    def __init__(self, result_ttl=JOB_RESULT_TTL):
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # id -> dict of Job fields plus owner, lease_until, finished
+
+    def add(self, job, max_queued):
+        with self._lock:
+            self._purge(time.time())
+            if sum(1 for entry in self._jobs.values() if entry["status"] == "queued") >= max_queued:
+                return False
+            self._jobs[job.id] = {**job._asdict(), "owner": None, "lease_until": 0.0, "finished": None}
+            return True
+
+    def claim(self, owner, lease):
+        now = time.time()
+        with self._lock:
+            for entry in self._jobs.values():
+                if entry["status"] == "queued" or (entry["status"] == "running" and entry["lease_until"] < now):
+                    entry.update(status="running", owner=owner, lease_until=now + lease)
+                    return self._job(entry)
+        return None
+
+    def renew(self, owner, lease):
+        now = time.time()
+        with self._lock:
+            for entry in self._jobs.values():
+                if entry["owner"] == owner and entry["status"] == "running":
+                    entry["lease_until"] = now + lease
+
+    def finish(self, job_id, status, reply=None):
+        """Record a final status unless the job already has one; returns whether it was recorded."""
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is None or entry["status"] in JOB_FINAL_STATUSES:
+                return False
+            entry.update(status=status, reply=reply, finished=time.time())
+            return True
+
+    def get(self, job_id, touch=False):
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is None:
+                return None
+            if touch:
+                entry["polled"] = time.time()
+            return self._job(entry)
+
+    def counts(self):
+        with self._lock:
+            return dict(Counter(entry["status"] for entry in self._jobs.values()))
+
+    def _purge(self, now):
+        for job_id in [job_id for job_id, entry in self._jobs.items()
+                       if entry["finished"] is not None and now - entry["finished"] > self.result_ttl]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _job(entry):
+        return Job(*(entry[field] for field in Job._fields))
+
+
+class SQLiteJobStore:
+    """Jobs shared by every worker on the instance; claims are single atomic UPDATEs."""
+
+    PURGE_INTERVAL = 60
+    COLUMNS = ", ".join(Job._fields)
+
+    def __init__(self, path=JOBS_DB, result_ttl=JOB_RESULT_TTL):
+        self.result_ttl = result_ttl
+        self.db = SQLiteDatabase(path)
+        self._last_purge = 0.0
+        with self.db.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                conversation_id TEXT NOT NULL,
+                message TEXT NOT NULL,
+                priority TEXT NOT NULL,
+                status TEXT NOT NULL,
+                reply TEXT,
+                created REAL NOT NULL,
+                deadline REAL NOT NULL,
+                polled REAL NOT NULL,
+                owner TEXT,
+                lease_until REAL NOT NULL DEFAULT 0,
+                finished REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created)")
+
+    def add(self, job, max_queued):
+        now = time.time()
+        with self.db.connect() as conn:
+            if now - self._last_purge > self.PURGE_INTERVAL:
+                self._last_purge = now
+                conn.execute("DELETE FROM jobs WHERE finished < ?", (now - self.result_ttl,))
+            cur = conn.execute(
+                f"INSERT INTO jobs ({self.COLUMNS}) SELECT ?, ?, ?, ?, ?, ?, ?, ?, ? "
+                "WHERE (SELECT COUNT(*) FROM jobs WHERE status = 'queued') < ?",
+                (*job, max_queued))
+            return cur.rowcount == 1
+
+    def claim(self, owner, lease):
+        now = time.time()
+        with self.db.connect() as conn:
+            rows = conn.execute(
+                f"""UPDATE jobs SET status = 'running', owner = ?, lease_until = ?
+                WHERE id = (SELECT id FROM jobs
+                            WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)
+                            ORDER BY created LIMIT 1)
+                RETURNING {self.COLUMNS}""",
+                (owner, now + lease, now)).fetchall()
+        return Job(*rows[0]) if rows else None
+
+    def renew(self, owner, lease):
+        with self.db.connect() as conn:
+            conn.execute("UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = 'running'",
+                         (time.time() + lease, owner))
+
+    def finish(self, job_id, status, reply=None):
+        with self.db.connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, reply = ?, finished = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (status, reply, time.time(), job_id))
+            return cur.rowcount == 1
+
+    def get(self, job_id, touch=False):
+        with self.db.connect() as conn:
+            if touch:
+                conn.execute("UPDATE jobs SET polled = ? WHERE id = ?", (time.time(), job_id))
+            row = conn.execute(f"SELECT {self.COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(*row) if row else None
+
+    def counts(self):
+        with self.db.connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+class ChatJobQueue:
+    """Runs queued chat turns on a few threads per worker, off the HTTP threads."""
+
+    def __init__(self, store, workers=JOB_WORKERS, max_queued=JOB_QUEUE_DEPTH, deadline=JOB_DEADLINE,
+                 abandon_after=JOB_ABANDON_AFTER):
+        self.store = store
+        self.workers = workers
+        self.max_queued = max_queued
+        self.deadline = deadline
+        self.abandon_after = abandon_after
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)  # a job run by this worker finished
+        self._kick = threading.Event()  # a job was queued or a thread freed up; dispatch now
+        self._pid = None
+        self._owner = None
+        self._executor = None
+        self._running = 0
+        self.stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "expired": 0, "cancelled": 0}
+
+    def _start(self):
+        # Threads don't survive gunicorn's fork; each worker starts its own dispatcher on first use
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._owner = f"{self._pid}-{uuid.uuid4().hex[:8]}"
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="chat-job")
+            self._running = 0
+            threading.Thread(target=self._dispatch, name="chat-job-dispatch", daemon=True).start()
+
+    def submit(self, conversation_id, message, priority="user"):
+        """Queue a chat turn and return its job id; raises JobQueueFull."""
+        self._start()
+        now = time.time()
+        job = Job(uuid.uuid4().hex, conversation_id, message, priority, "queued", None, now, now + self.deadline, now)
+        if not self.store.add(job, self.max_queued):
+            self._count("rejected")
+            raise JobQueueFull()
+        with self._lock:
+            self.stats["submitted"] += 1
+        self._kick.set()
+        return job.id
+
+    def result(self, job_id, wait=0.0):
+        """The job, once final or after waiting up to wait seconds; None if unknown."""
+        self._start()
+        give_up = time.monotonic() + wait
+        touched = None
+        while True:
+            # Mark the job as polled once per request (and again if the wait outlasts half
+            # of abandon_after), not on every check: with SQLite each touch is a write
+            now = time.monotonic()
+            touch = touched is None or now - touched > self.abandon_after / 2
+            if touch:
+                touched = now
+            job = self.store.get(job_id, touch=touch)
+            remaining = give_up - time.monotonic()
+            if job is None or job.status in JOB_FINAL_STATUSES or remaining <= 0:
+                return job
+            # Woken by local jobs finishing; jobs run by other workers are seen on the next check
+            with self._finished:
+                self._finished.wait(min(remaining, 0.5))
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; a running Gemini call finishes but its reply is dropped."""
+        if self.store.finish(job_id, "cancelled"):
+            self._count("cancelled")
+            return True
+        return False
+
+    def _dispatch(self):
+        last_renewal = 0.0
+        while True:
+            # Cleared before claiming, so a job queued meanwhile sets it again and isn't missed
+            self._kick.clear()
+            try:
+                if time.monotonic() - last_renewal > JOB_LEASE / 3:
+                    last_renewal = time.monotonic()
+                    self.store.renew(self._owner, JOB_LEASE)
+                while self._running < self.workers:
+                    job = self.store.claim(self._owner, JOB_LEASE)
+                    if job is None:
+                        break
+                    with self._lock:
+                        self._running += 1
+                    self._executor.submit(self._run, job)
+            except Exception as dispatch_error:
+                log.error("Job dispatch failed: %s", dispatch_error, exc_info=True)
+            self._kick.wait(JOB_DISPATCH_INTERVAL)
+
+    def _run(self, job):
+        try:
+            now = time.time()
+            if now > job.deadline:
+                status, reply = "expired", None
+            elif now - job.polled > self.abandon_after:
+                # The client stopped polling (closed the page), so nobody would read the reply
+                status, reply = "cancelled", None
+            else:
+                reply = self._answer(job)
+                status = "done"
+                # Not saved to history if the client cancelled while Gemini was answering
+                if self.store.get(job.id).status == "running":
+                    save_chat_turn(job.conversation_id, job.message, reply)
+            if self.store.finish(job.id, status, reply):
+                self._count(status)
+        except Exception as job_error:
+            log.error("Chat job failed: %s", job_error, exc_info=True, extra={"job_id": job.id})
+            if self.store.finish(job.id, "failed", EMPTY_REPLY):
+                self._count("failed")
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._finished.notify_all()
+            self._kick.set()
+
+    def _answer(self, job):
+        # History and school info as they are now, not when the job was queued
+        knowledge = school_knowledge.current()
+        conversation = conversation_store.get_state(job.conversation_id)
+        model, error_reply = get_model_or_reply()
+        if model is None:
+            return error_reply
+        return gemini_turn(model, job.message, conversation, knowledge, job.priority)
+
+    def _count(self, status):
+        metrics.inc("ratna_jobs_total", status=status)
+        with self._lock:
+            self.stats[status] += 1
+
+    def status(self):
+        with self._lock:
+            stats = {"store": type(self.store).__name__, "running": self._running, **self.stats}
+        return {**stats, "jobs": self.store.counts()}
+
+
+job_queue = ChatJobQueue(MemoryJobStore() if JOB_STORE == "memory" else SQLiteJobStore())
+
+
+def job_response(job):
+    body = {"job_id": job.id, "status": job.status}
+    if job.reply is not None:
+        body["reply"] = job.reply
+    return jsonify(body), 200 if job.status in JOB_FINAL_STATUSES else 202
+
+
+def session_job(job_id):
+    """The job if it belongs to this session's conversation, else None."""
+    job = job_queue.store.get(job_id)
+    if job is None or job.conversation_id != session.get("conversation_id"):
+        return None
+    return job
+
+
+@app.route("/result/<job_id>", methods=["GET"])
+def job_result(job_id):
+    if session_job(job_id) is None:
+        return jsonify({"status": "error", "message": "Job not found."}), 404
+    wait = min(max(request.args.get("wait", 0, type=float), 0.0), JOB_POLL_MAX_WAIT)
+    return job_response(job_queue.result(job_id, wait))
+
+
+@app.route("/result/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    if session_job(job_id) is None:
+        return jsonify({"status": "error", "message": "Job not found."}), 404
+    job_queue.cancel(job_id)
+    return job_response(job_queue.store.get(job_id))
+
+# ----------------------
+# Upstream status (rate-limit circuit breaker)
+# ----------------------
+@app.route("/upstream-status")
+def upstream_status():
+    return jsonify({**upstream_health.status(), "admission": admission.status(), "rate_limits": rate_limiter.status()})
+
+# ----------------------
+# Metrics (Prometheus scrape endpoint)
+# ----------------------
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 # ----------------------
 # Test Endpoint for Debugging
 # ----------------------
@@ -735,11 +3438,11 @@ Guidelines:
 def test_gemini():
     """Test endpoint to check Gemini API connection"""
     try:
-        if not GEMINI_API_KEY:
+        if not GEMINI_READY:
             return jsonify({"error": "API key not configured", "status": "error"})
         
         # List all models
-        all_models = list(genai.list_models())
+        all_models = list(gemini.list_models(request_options=call_options()))
         model_info = []
         for m in all_models:
             model_info.append({
@@ -755,9 +3458,9 @@ def test_gemini():
         
         for test_model in test_models:
             try:
-                model = genai.GenerativeModel(test_model)
-                # Try a simple generation
-                response = model.generate_content("Hello")
+                model = gemini.model(test_model)
+                # Count tokens instead of generating, so probes don't use generation quota
+                model.count_tokens("Hello", request_options=call_options())
                 working_model = test_model
                 break
             except Exception as e:
@@ -789,8 +3492,7 @@ def submit_feedback():
     if not feedback_text:
         return jsonify({"status": "error", "message": "Feedback is empty."}), 400
 
-    with open(FEEDBACKS_FILE, "a", encoding="utf-8") as f:
-        f.write(feedback_text + "\n---\n")
+    feedback_store.add(feedback_text)
 
     return jsonify({"status": "success", "message": "Feedback received. Thank you!"}), 200
 
@@ -800,29 +3502,20 @@ def delete_feedback():
     if "username" not in session:
         return jsonify({"status": "error", "message": "Unauthorized."}), 401
     data = request.get_json()
-    idx = data.get("index")
+    feedback_id = data.get("id")
     try:
-        idx = int(idx)
+        feedback_id = int(feedback_id)
     except (TypeError, ValueError):
-        return jsonify({"status": "error", "message": "Invalid index."}), 400
-    if not os.path.exists(FEEDBACKS_FILE):
-        return jsonify({"status": "error", "message": "No feedbacks found."}), 400
-    with open(FEEDBACKS_FILE, "r", encoding="utf-8") as f:
-        content = f.read()
-        feedbacks = [fb.strip() for fb in content.split("---") if fb.strip()]
-    if idx < 0 or idx >= len(feedbacks):
-        return jsonify({"status": "error", "message": "Index out of range."}), 400
-    del feedbacks[idx]
-    with open(FEEDBACKS_FILE, "w", encoding="utf-8") as f:
-        for fb in feedbacks:
-            f.write(fb + "\n---\n")
+        return jsonify({"status": "error", "message": "Invalid id."}), 400
+    if not feedback_store.delete(feedback_id):
+        return jsonify({"status": "error", "message": "Feedback not found."}), 404
     return jsonify({"status": "success", "message": "Feedback deleted."})
 
 @app.route("/delete-all-feedbacks", methods=["POST"])
 def delete_all_feedbacks():
     if "username" not in session:
         return jsonify({"status": "error", "message": "Unauthorized."}), 401
-    open(FEEDBACKS_FILE, "w", encoding="utf-8").close()  # truncate
+    feedback_store.delete_all()
     return jsonify({"status": "success", "message": "All feedbacks deleted."})
 
 @app.route("/view-feedbacks")
@@ -830,14 +3523,12 @@ def view_feedbacks():
     if "username" not in session:
         flash("Only logged-in users can view feedbacks.", "warning")
         return redirect(url_for("login"))
-    if not os.path.exists(FEEDBACKS_FILE):
-        feedbacks = []
-    else:
-        with open(FEEDBACKS_FILE, "r", encoding="utf-8") as f:
-            content = f.read()
-            feedbacks = [fb.strip() for fb in content.split("---") if fb.strip()]
-    feedback_items = list(enumerate(feedbacks))
-    return render_template("feedbacks.html", feedbacks=feedbacks, feedback_items=feedback_items)
+    page = max(request.args.get("page", 1, type=int), 1)
+    size = min(max(request.args.get("size", FEEDBACK_PAGE_SIZE, type=int), 1), FEEDBACK_MAX_PAGE_SIZE)
+    total = feedback_store.count()
+    pages = max((total + size - 1) // size, 1)
+    feedbacks = feedback_store.list(page, size)
+    return render_template("feedbacks.html", feedbacks=feedbacks, page=page, size=size, pages=pages, total=total)
 
 # ----------------------
 # Run App
@@ -845,4 +3536,5 @@ def view_feedbacks():
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     debug = os.environ.get("FLASK_ENV") == "development"
+    start_gemini_warmup()
     app.run(host="0.0.0.0", port=port, debug=debug)
\ No newline at end of file
@@ -0,0 +1,254 @@
+"""Load-test the app offline against the fake Gemini backend.
+
+Starts the app under gunicorn (or the Flask dev server) with GEMINI_BACKEND=fake
+and throwaway databases, drives it with concurrent clients over HTTP and prints
+latency percentiles and throughput per scenario. No API key or network needed.
+
+    python benchmarks/bench_app.py                          # every scenario
+    python benchmarks/bench_app.py chat stream -c 100 -n 2000 --latency 1.5
+    python benchmarks/bench_app.py chat --rate-429 0.05     # inject Gemini 429s
+    python benchmarks/bench_app.py --url http://127.0.0.1:5000 login
+
+With --url the benchmark targets a server that is already running (start it
+with GEMINI_BACKEND=fake to keep it offline); the --latency/--rate-429 options
+then have no effect.
+"""
+import argparse, http.client, itertools, json, math, os, socket, subprocess, sys, tempfile, threading, time
+from urllib.parse import urlencode, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_USER = ("benchmarkuser", "Benchmark1")
+QUESTIONS = [
+    "Who is the principal of the school?",
+    "What are the school timings?",
+    "Tell me about the science lab.",
+    "Which sports are played at the school?",
+    "How can I contact the school office?",
+]
+
+
+class Client:
+    """One keep-alive connection with its own session cookie."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.conn = None
+        self.cookie = None
+
+    def request(self, method, path, form=None, json_body=None):
+        headers = {}
+        body = None
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        if form is not None:
+            body = urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        elif json_body is not None:
+            body = json.dumps(json_body)
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            try:
+                if self.conn is None:
+                    self.conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # The server closed an idle keep-alive connection; reconnect once
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        cookie = response.getheader("Set-Cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        return response.status, data
+
+
+def reply_of(status, data):
+    """The chat reply in a /get (JSON) or /stream (server-sent events) response body."""
+    text = data.decode("utf-8", "replace")
+    if text.startswith("{"):
+        return json.loads(text).get("reply", "")
+    done = text.rsplit("event: done\ndata: ", 1)
+    return json.loads(done[1]).get("reply", "") if len(done) == 2 else ""
+
+
+# Each scenario: (setup(client), step(client, i) -> (status, body) for the timed request,
+# optional untimed before(client, i), whether the body is a chat reply)
+def as_guest(client):
+    client.request("GET", "/use-guest")
+
+
+def as_user(client):
+    client.request("POST", "/login", form={"username": BENCH_USER[0], "password": BENCH_USER[1]})
+
+
+SCENARIOS = {
+    "page": (as_guest, lambda c, i: c.request("GET", "/"), None, False),
+    "local": (as_guest, lambda c, i: c.request("GET", "/get?" + urlencode({"msg": "hello"})), None, True),
+    "chat": (as_guest, lambda c, i: c.request("GET", "/get?" + urlencode(
+        {"msg": f"{QUESTIONS[i % len(QUESTIONS)]} (question {i})"})), None, True),
+    "cached": (as_guest, lambda c, i: c.request("GET", "/get?" + urlencode({"msg": QUESTIONS[i % len(QUESTIONS)]})),
+               lambda c, i: c.request("GET", "/use-guest"), True),
+    "stream": (as_guest, lambda c, i: c.request("GET", "/stream?" + urlencode(
+        {"msg": f"{QUESTIONS[i % len(QUESTIONS)]} (question {i})"})), None, True),
+    "login": (lambda c: None, lambda c, i: c.request(
+        "POST", "/login", form={"username": BENCH_USER[0], "password": BENCH_USER[1]}), None, False),
+    "feedback": (as_guest, lambda c, i: c.request(
+        "POST", "/submit-feedback", json_body={"feedback": f"Benchmark feedback {i}"}), None, False),
+    "view-feedbacks": (as_user, lambda c, i: c.request("GET", "/view-feedbacks"), None, False),
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    return sorted_values[max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)]
+
+
+def run_scenario(base_url, name, concurrency, total):
+    setup, step, before, is_chat = SCENARIOS[name]
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies, errors, degraded = [], [0], [0]
+
+    def worker():
+        client = Client(base_url)
+        setup(client)
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            if before:
+                before(client, i)
+            started = time.perf_counter()
+            try:
+                status, data = step(client, i)
+            except Exception:
+                status, data = None, b""
+            elapsed = time.perf_counter() - started
+            warned = is_chat and status == 200 and reply_of(status, data).startswith("⚠️")
+            with lock:
+                latencies.append(elapsed)
+                if status is None or status >= 400:
+                    errors[0] += 1
+                elif warned:
+                    degraded[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "degraded": degraded[0],
+        "rps": round(len(latencies) / wall, 1) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_BACKEND": "fake",
+        "FAKE_GEMINI_LATENCY": str(args.latency),
+        "FAKE_GEMINI_429_RATE": str(args.rate_429),
+        "PORT": str(port),
+        "USERS_DB": os.path.join(workdir, "users.db"),
+        "FEEDBACKS_DB": os.path.join(workdir, "feedbacks.db"),
+        "CONVERSATIONS_DB": os.path.join(workdir, "conversations.db"),
+        "METRICS_DB": os.path.join(workdir, "metrics.db"),
+        "RATE_LIMIT_DB": os.path.join(workdir, "ratelimits.db"),
+        "JOBS_DB": os.path.join(workdir, "jobs.db"),
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+    })
+    if not args.keep_limits:
+        # Every benchmark client comes from 127.0.0.1; measure the app, not the limiter
+        env.update({"RATE_LIMIT_SESSION": "off", "RATE_LIMIT_USER": "off", "RATE_LIMIT_IP": "off", "GEMINI_QUOTA": "off"})
+    if args.workers:
+        env["WEB_CONCURRENCY"] = str(args.workers)
+    if args.server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port), "--with-threads"]
+    log_file = open(os.path.join(workdir, "server.log"), "wb")
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"Server exited during startup; see {log_file.name}")
+        try:
+            if Client(base_url).request("GET", "/login")[0] == 200:
+                return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit(f"Server did not start within 60 seconds; see {log_file.name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("-c", "--concurrency", type=int, default=50, help="concurrent clients (default 50)")
+    parser.add_argument("-n", "--requests", type=int, default=500, help="requests per scenario (default 500)")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake Gemini latency in seconds (default 0.5)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of fake Gemini calls rate limited")
+    parser.add_argument("--server", choices=["gunicorn", "flask"], default="gunicorn")
+    parser.add_argument("--workers", type=int, help="gunicorn workers (WEB_CONCURRENCY)")
+    parser.add_argument("--keep-limits", action="store_true", help="keep the app's rate limits and quota admission")
+    parser.add_argument("--url", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    process = None
+    with tempfile.TemporaryDirectory(prefix="ratna-bench-") as workdir:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            process, base_url = start_server(args, workdir)
+        try:
+            # Account used by the login and view-feedbacks scenarios (already existing is fine)
+            Client(base_url).request("POST", "/signup", form={"username": BENCH_USER[0], "password": BENCH_USER[1]})
+            if not args.json:
+                print(f"{'scenario':<15}{'requests':>9}{'errors':>8}{'degraded':>10}{'req/s':>9}"
+                      f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+            for name in args.scenarios or list(SCENARIOS):
+                result = run_scenario(base_url, name, args.concurrency, args.requests)
+                if args.json:
+                    print(json.dumps(result))
+                else:
+                    print(f"{name:<15}{result['requests']:>9}{result['errors']:>8}{result['degraded']:>10}"
+                          f"{result['rps']:>9}{result['p50_ms']:>9}{result['p95_ms']:>9}{result['p99_ms']:>9}"
+                          f"{result['max_ms']:>9}")
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Measure cold-start time: importing app.py and serving the first page.
+
+Each run uses a fresh Python process (like a Render worker booting) with
+throwaway databases, and reports the median of:
+
+- import: `import app`
+- first /login: import plus rendering /login once
+- first chat: import plus one /get answered by the fake Gemini backend
+- gemini client: importing google.generativeai and google.api_core, which
+  app.py used to do at import time and now does on the first real chat call
+  (or in the background warm-up after a worker boots)
+
+    python benchmarks/bench_import.py            # 5 runs
+    python benchmarks/bench_import.py -n 10 --top 15
+"""
+import argparse, json, os, statistics, subprocess, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBES = {
+    "import": "import app",
+    "first /login": "import app\nassert app.app.test_client().get('/login').status_code == 200",
+    "first chat": (
+        "import app\n"
+        "client = app.app.test_client()\n"
+        "client.get('/use-guest')\n"
+        "assert client.get('/get?msg=Tell+me+about+the+science+lab').status_code == 200"
+    ),
+    "gemini client": "import google.generativeai, google.api_core.exceptions",
+}
+
+TIMER = "import time\n_started = time.perf_counter()\n{code}\nprint(time.perf_counter() - _started)"
+
+
+def run_probe(code, workdir, env_overrides=None):
+    env = dict(os.environ)
+    env.update({
+        "USERS_DB": os.path.join(workdir, "users.db"),
+        "FEEDBACKS_DB": os.path.join(workdir, "feedbacks.db"),
+        "CONVERSATIONS_DB": os.path.join(workdir, "conversations.db"),
+        "METRICS_DB": os.path.join(workdir, "metrics.db"),
+        "RATE_LIMIT_DB": os.path.join(workdir, "ratelimits.db"),
+        "JOBS_DB": os.path.join(workdir, "jobs.db"),
+        "LOG_LEVEL": "WARNING",
+        "PYTHONWARNINGS": "ignore",
+    })
+    env.update(env_overrides or {})
+    result = subprocess.run(
+        [sys.executable, "-c", TIMER.format(code=code)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(workdir, top):
+    """The modules with the largest cumulative import time when importing app."""
+    env = dict(os.environ, USERS_DB=os.path.join(workdir, "users.db"),
+               FEEDBACKS_DB=os.path.join(workdir, "feedbacks.db"),
+               CONVERSATIONS_DB=os.path.join(workdir, "conversations.db"),
+               RATE_LIMIT_DB=os.path.join(workdir, "ratelimits.db"), JOBS_DB=os.path.join(workdir, "jobs.db"),
+               LOG_LEVEL="WARNING")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        rows.append((int(cumulative) / 1e6, module.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--runs", type=int, default=5, help="fresh processes per probe (default 5)")
+    parser.add_argument("--top", type=int, default=0, help="also list the N slowest imports of app")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="ratna-import-") as workdir:
+        # The first run seeds the databases, so it is not timed
+        run_probe(PROBES["import"], workdir)
+        for name, code in PROBES.items():
+            overrides = {"GEMINI_BACKEND": "fake", "FAKE_GEMINI_LATENCY": "0"} if name == "first chat" else None
+            times = [run_probe(code, workdir, overrides) for _ in range(args.runs)]
+            results[name] = {"median_ms": round(statistics.median(times) * 1000, 1),
+                             "min_ms": round(min(times) * 1000, 1)}
+        imports = slowest_imports(workdir, args.top) if args.top else []
+
+    if args.json:
+        print(json.dumps({"runs": args.runs, "results": results,
+                          "slowest_imports": [{"module": m, "seconds": s} for s, m in imports]}))
+        return
+    print(f"{'probe':<16}{'median ms':>11}{'min ms':>10}   ({args.runs} runs)")
+    for name, result in results.items():
+        print(f"{name:<16}{result['median_ms']:>11}{result['min_ms']:>10}")
+    if imports:
+        print("\nSlowest imports of app (cumulative):")
+        for seconds, module in imports:
+            print(f"{seconds * 1000:>10.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
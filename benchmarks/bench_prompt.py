@@ -0,0 +1,122 @@
+"""Microbenchmark of the per-turn prompt assembly (PromptBuilder.build).
+
+Compares the builder with the assembly it replaced (four strftime calls per
+turn, a separate string for each context block and for the joined school
+passages, then one more for the full message) on a first question and on a
+follow-up with a running summary. Reports CPU time and the peak of transient
+allocations per turn; "retrieval" is the BM25 search that both include.
+
+    python benchmarks/bench_prompt.py
+    python benchmarks/bench_prompt.py -n 50000 --json
+"""
+import argparse, datetime, json, os, sys, tempfile, time, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(workdir):
+    os.environ.update({
+        "GEMINI_BACKEND": "fake",
+        "USERS_DB": os.path.join(workdir, "users.db"),
+        "FEEDBACKS_DB": os.path.join(workdir, "feedbacks.db"),
+        "CONVERSATIONS_DB": os.path.join(workdir, "conversations.db"),
+        "METRICS_DB": os.path.join(workdir, "metrics.db"),
+        "JOBS_DB": os.path.join(workdir, "jobs.db"),
+        "RATE_LIMIT_DB": os.path.join(workdir, "ratelimits.db"),
+        "LOG_LEVEL": "ERROR",
+    })
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import app
+    return app
+
+
+def legacy_build(app, user_message, conversation):
+    """The per-turn assembly before PromptBuilder, kept here for comparison."""
+    now = datetime.datetime.now()
+    datetime_context = (f"[Current date and time: {now.strftime('%A')}, {now.strftime('%B %d, %Y')}, "
+                        f"{now.strftime('%I:%M %p')} ({now.strftime('%Y-%m-%d %H:%M:%S')})]")
+    query = user_message
+    for msg in reversed(conversation.messages):
+        if msg.get("role") == "user":
+            query = f"{msg.get('content', '')} {user_message}"
+            break
+    knowledge = app.school_knowledge.current()
+    hits = knowledge.index.search(query, app.RETRIEVAL_TOP_K)
+    school_info = "\n\n".join(f"{knowledge.chunks[i].title}:\n{knowledge.chunks[i].text}" for i, _ in sorted(hits))
+    school_context = f"[Relevant school info:\n{school_info}]" if school_info else ""
+    summary = conversation.summary
+    summary_context = f"[Summary of the earlier conversation: {summary}]" if summary else ""
+    context = "\n".join(part for part in (datetime_context, summary_context, school_context) if part)
+    return f"{context}\n\n{user_message}"
+
+
+def time_per_call(fn, runs):
+    fn()
+    started = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - started) / runs
+
+
+def peak_allocation(fn, runs):
+    """Average peak of memory allocated and not yet freed during one call, in bytes."""
+    fn()
+    tracemalloc.start()
+    total = 0
+    for _ in range(runs):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        fn()
+        total += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return total / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--runs", type=int, default=20000, help="calls timed per case (default 20000)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="ratna-prompt-") as workdir:
+        app = load_app(workdir)
+        knowledge = app.school_knowledge.current()
+        State = app.ConversationState
+        turns = {
+            "first turn": ("Who teaches science in Grade 10?", State("c1", [], 0, "", 0)),
+            "follow-up": ("What is her qualification?", State("c2", [
+                {"role": "user", "content": "Who teaches science in Grade 10?"},
+                {"role": "assistant", "content": "Science in Grade 10 is taught by our science teacher."},
+            ], 4, "The user asked about school timings and the principal. " * 4, 4)),
+        }
+        builder = app.prompt_builder
+        results = []
+        for turn, (message, conversation) in turns.items():
+            query = f"{conversation.messages[0]['content']} {message}" if conversation.messages else message
+            cases = {
+                "retrieval": lambda: app.retrieve_passages(query, app.RETRIEVAL_TOP_K, knowledge),
+                "previous": lambda: legacy_build(app, message, conversation),
+                "PromptBuilder": lambda: builder.build(message, conversation, knowledge),
+            }
+            for name, fn in cases.items():
+                results.append({
+                    "turn": turn,
+                    "case": name,
+                    "us_per_turn": round(time_per_call(fn, args.runs) * 1e6, 2),
+                    "peak_bytes_per_turn": round(peak_allocation(fn, min(args.runs, 2000))),
+                    "prompt_chars": len(fn()) if name != "retrieval" else None,
+                })
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    print(f"{'turn':<12}{'case':<15}{'us/turn':>10}{'peak KB':>10}{'prompt chars':>14}   ({args.runs} runs)")
+    for r in results:
+        chars = r["prompt_chars"] if r["prompt_chars"] is not None else "-"
+        print(f"{r['turn']:<12}{r['case']:<15}{r['us_per_turn']:>10}{r['peak_bytes_per_turn'] / 1024:>10.1f}{chars:>14}")
+
+
+if __name__ == "__main__":
+    main()
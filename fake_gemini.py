@@ -0,0 +1,140 @@
+"""Offline stand-in for the Gemini API, for load tests and benchmarks.
+
+Selected with GEMINI_BACKEND=fake (no API key or network needed). It mimics
+the parts of google.generativeai that app.py uses and is tuned with:
+
+- FAKE_GEMINI_LATENCY: seconds before a reply (or its first chunk), default 0.5
+- FAKE_GEMINI_JITTER: random extra latency, up to this many seconds, default 0
+- FAKE_GEMINI_CHUNKS: chunks per streamed reply, default 5
+- FAKE_GEMINI_CHUNK_DELAY: seconds between streamed chunks, default 0.05
+- FAKE_GEMINI_429_RATE: fraction of calls failing with a rate limit, default 0
+- FAKE_GEMINI_MODELS: comma separated model names, default models/gemini-fake
+
+Like the real client, calls take request_options={"timeout": seconds} and fail
+with DeadlineExceeded once the reply would take longer than that.
+"""
+import os, random, threading, time
+from types import SimpleNamespace
+
+from google.api_core import exceptions as google_exceptions
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+class FakeResponse:
+    """A reply (or one streamed chunk) shaped like GenerateContentResponse."""
+
+    def __init__(self, text, prompt_tokens=0, chunks=None):
+        self.text = text
+        self.candidates = [SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))]
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens, candidates_token_count=max(len(text) // 4, 1))
+        self._chunks = chunks
+
+    def __iter__(self):
+        return iter(self._chunks if self._chunks is not None else [self])
+
+
+class FakeChat:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, generation_config=None, stream=False, request_options=None):
+        context = sum(len(part) for msg in self.history for part in msg.get("parts", []))
+        response = self.model._respond(content, context, stream, request_options)
+        self.history += [{"role": "user", "parts": [content]}, {"role": "model", "parts": [response.text]}]
+        return response
+
+
+class FakeModel:
+    def __init__(self, backend, name, system_instruction=None):
+        self.backend = backend
+        self.model_name = name
+        self.system_instruction = system_instruction or ""
+
+    def generate_content(self, contents, generation_config=None, stream=False, request_options=None):
+        return self._respond(str(contents), 0, stream, request_options)
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history)
+
+    def count_tokens(self, contents, request_options=None):
+        return SimpleNamespace(total_tokens=len(str(contents)) // 4)
+
+    def _respond(self, content, context_chars, stream, request_options=None):
+        backend = self.backend
+        backend._record_call()
+        latency = backend.latency + backend.jitter * backend._random()
+        timeout = (request_options or {}).get("timeout")
+        if timeout is not None and latency > timeout:
+            time.sleep(max(timeout, 0))
+            raise google_exceptions.DeadlineExceeded("504 Deadline Exceeded")
+        time.sleep(latency)
+        if backend.rate_limit_rate and backend._random() < backend.rate_limit_rate:
+            backend._record_rate_limit()
+            raise google_exceptions.ResourceExhausted(
+                "429 Resource has been exhausted (e.g. check quota). Please retry in 2s")
+
+        question = content.strip().splitlines()[-1][:80] if content.strip() else ""
+        text = f"This is a fake reply from {self.model_name} to: {question}"
+        prompt_tokens = (len(self.system_instruction) + context_chars + len(content)) // 4
+        if not stream:
+            return FakeResponse(text, prompt_tokens)
+        size = max(len(text) // backend.chunks, 1)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        return FakeResponse(text, prompt_tokens, chunks=self._stream(pieces, prompt_tokens))
+
+    def _stream(self, pieces, prompt_tokens):
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(self.backend.chunk_delay)
+            # Like Gemini, usage metadata arrives with the chunks
+            yield FakeResponse(piece, prompt_tokens)
+
+
+class FakeGeminiBackend:
+    requires_key = False
+
+    def __init__(self, latency=None, jitter=None, chunks=None, chunk_delay=None, rate_limit_rate=None, models=None):
+        self.latency = _env_float("FAKE_GEMINI_LATENCY", "0.5") if latency is None else latency
+        self.jitter = _env_float("FAKE_GEMINI_JITTER", "0") if jitter is None else jitter
+        self.chunks = int(os.environ.get("FAKE_GEMINI_CHUNKS", "5")) if chunks is None else chunks
+        self.chunk_delay = _env_float("FAKE_GEMINI_CHUNK_DELAY", "0.05") if chunk_delay is None else chunk_delay
+        self.rate_limit_rate = _env_float("FAKE_GEMINI_429_RATE", "0") if rate_limit_rate is None else rate_limit_rate
+        self.models = models or [
+            name.strip() for name in os.environ.get("FAKE_GEMINI_MODELS", "models/gemini-fake").split(",") if name.strip()]
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+        self.stats = {"calls": 0, "rate_limited": 0}
+
+    def _random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def _record_call(self):
+        with self._lock:
+            self.stats["calls"] += 1
+
+    def _record_rate_limit(self):
+        with self._lock:
+            self.stats["rate_limited"] += 1
+
+    def configure(self, api_key):
+        pass
+
+    def list_models(self, request_options=None):
+        return [SimpleNamespace(name=name, display_name=name.split("/")[-1],
+                                supported_generation_methods=["generateContent", "countTokens"])
+                for name in self.models]
+
+    def model(self, name, system_instruction=None):
+        return FakeModel(self, name, system_instruction)
+
+    def generation_config(self, **options):
+        return dict(options)
+
+    def status(self):
+        return {"transport": "fake", "latency": self.latency, **self.stats}
@@ -0,0 +1,44 @@
+# Gunicorn config for Render (picked up automatically from the project root).
+#
+# Chat requests spend nearly all their time waiting on Gemini, so each worker
+# runs many threads (gthread) and a handful of workers is enough for hundreds
+# of waiting chats. Set GUNICORN_WORKER_CLASS=gevent (and `pip install gevent`)
+# to use green threads instead; Gemini is then called over REST, because the
+# default gRPC transport does not cooperate with gevent's monkey-patching.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2, 4)))
+
+if worker_class == "gevent":
+    worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "500"))
+    os.environ.setdefault("GEMINI_TRANSPORT", "rest")
+else:
+    threads = int(os.environ.get("GUNICORN_THREADS", "64"))
+
+# Long enough for a slow Gemini reply or a long /stream response
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# The app writes its own JSON access records (logger "ratna.access")
+accesslog = os.environ.get("GUNICORN_ACCESSLOG") or None
+
+
+def on_starting(server):
+    # /metrics sums per-worker snapshots; start each server run from zero
+    metrics_db = os.environ.get("METRICS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics.db"))
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(metrics_db + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def post_worker_init(worker):
+    # The app is loaded; import and configure the Gemini client off the request path
+    from app import start_gemini_warmup
+    start_gemini_warmup()
@@ -0,0 +1,415 @@
+    // Dark mode toggle logic
+    const toggleDM = document.getElementById('toggleDM');
+    toggleDM.addEventListener('change', () => {
+      document.body.classList.toggle('light', toggleDM.checked);
+    });
+
+    // Elements
+    const chatHistory = document.getElementById('chatHistory');
+    const chatbox = document.getElementById('chatbox');
+    const userInput = document.getElementById('userInput');
+    const sendBtn = document.getElementById('sendBtn');
+    const voiceBtn = document.getElementById('voiceBtn');
+    const clearChatBtn = document.getElementById('clearChatBtn');
+    const shareBtn = document.getElementById('shareBtn');
+    const modalOverlay = document.getElementById('modalOverlay');
+    const modalTitle = document.getElementById('modalTitle');
+    const modalContent = document.getElementById('modalContent');
+    const modalCloseBtn = document.getElementById('modalCloseBtn');
+
+    let conversationHistory = [];
+
+    // (Removed drag-to-resize logic)
+
+    // Helper: convert URLs in text to clickable links
+    function linkify(text) {
+      const urlRegex = /(https?:\/\/[^\s]+)|(www\.[^\s]+)/gi;
+      return text.replace(urlRegex, (match) => {
+        const url = match.startsWith('http') ? match : `https://${match}`;
+        return `<a href="${url}" target="_blank" rel="noopener noreferrer">${match}</a>`;
+      });
+    }
+
+    // Append message function
+    function appendMessage(text, sender) {
+      const messageDiv = document.createElement('div');
+      messageDiv.className = sender === 'user' ? 'user-msg' : 'bot-msg';
+      const bubble = document.createElement('div');
+      bubble.className = 'msg';
+
+      if (sender === 'bot') {
+        bubble.textContent = '';
+        messageDiv.appendChild(bubble);
+        chatbox.appendChild(messageDiv);
+        chatbox.scrollTop = chatbox.scrollHeight;
+        // Letter-by-letter typing effect, fast
+        let i = 0;
+        const speed = 5; // ms per character (increased speed)
+        function typeChar() {
+          if (i <= text.length) {
+            bubble.textContent = text.slice(0, i);
+            chatbox.scrollTop = chatbox.scrollHeight;
+            i++;
+            setTimeout(typeChar, speed);
+          } else {
+            // Replace with linkified HTML once finished
+            bubble.innerHTML = linkify(text);
+          }
+        }
+        typeChar();
+      } else {
+        bubble.textContent = text;
+        messageDiv.appendChild(bubble);
+        chatbox.appendChild(messageDiv);
+        chatbox.scrollTop = chatbox.scrollHeight;
+      }
+    }
+
+    // Show typing indicator (animated dots)
+    function appendTyping() {
+      const typingDiv = document.createElement('div');
+      typingDiv.className = 'bot-msg typing';
+      typingDiv.id = 'typingIndicator';
+      typingDiv.innerHTML =
+        '<span class="typing-text">Ratna Chatbot is typing</span>' +
+        '<span class="typing-dots" aria-hidden="true">'
+          + '<span class="dot"></span>'
+          + '<span class="dot"></span>'
+          + '<span class="dot"></span>'
+        + '</span>';
+      chatbox.appendChild(typingDiv);
+      chatbox.scrollTop = chatbox.scrollHeight;
+    }
+
+    // Remove typing indicator
+    function removeTyping() {
+      const typingDiv = document.getElementById('typingIndicator');
+      if (typingDiv) typingDiv.remove();
+    }
+
+    // Render chat history list on left panel
+    function renderChatHistory() {
+      // Remove old items except buttons and heading
+      const items = [...chatHistory.querySelectorAll('.history-item')];
+      items.forEach(el => el.remove());
+
+      conversationHistory.forEach((conv, idx) => {
+        const preview = conv.user.length > 28 ? conv.user.slice(0, 25) + '...' : conv.user;
+        const item = document.createElement('div');
+        item.className = 'history-item';
+        item.textContent = preview;
+        item.title = conv.user;
+        item.tabIndex = 0;
+        item.setAttribute('role', 'button');
+        item.setAttribute('aria-pressed', 'false');
+
+        // On click or keyboard enter, load this conversation
+        item.addEventListener('click', () => {
+          loadConversation(idx);
+        });
+        item.addEventListener('keydown', (e) => {
+          if(e.key === 'Enter' || e.key === ' ') {
+            loadConversation(idx);
+            e.preventDefault();
+          }
+        });
+
+        chatHistory.insertBefore(item, clearChatBtn);
+      });
+    }
+
+    // Load a conversation from history into chatbox
+    function loadConversation(index) {
+      if (index < 0 || index >= conversationHistory.length) return;
+      chatbox.innerHTML = '';
+      const conv = conversationHistory[index];
+      appendMessage(conv.user, 'user');
+      appendMessage(conv.bot, 'bot');
+    }
+
+    // Create an empty bot bubble that streamed text is written into
+    function appendStreamingBubble() {
+      const messageDiv = document.createElement('div');
+      messageDiv.className = 'bot-msg';
+      const bubble = document.createElement('div');
+      bubble.className = 'msg';
+      messageDiv.appendChild(bubble);
+      chatbox.appendChild(messageDiv);
+      chatbox.scrollTop = chatbox.scrollHeight;
+      return bubble;
+    }
+
+    // Read a Server-Sent Events stream from fetch, calling onEvent(event, data) per event
+    async function readEventStream(response, onEvent) {
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const raw = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          let event = 'message';
+          let data = '';
+          raw.split('\n').forEach(line => {
+            if (line.startsWith('event: ')) event = line.slice(7);
+            else if (line.startsWith('data: ')) data += line.slice(6);
+          });
+          if (data) onEvent(event, JSON.parse(data));
+        }
+      }
+    }
+
+    // Send message function
+    function sendMessage() {
+      const message = userInput.value.trim();
+      if (!message) return;
+
+      appendMessage(message, 'user');
+      userInput.value = '';
+      userInput.disabled = true;
+      sendBtn.disabled = true;
+      voiceBtn.disabled = true;
+      voiceBtn.classList.remove('listening');
+
+      appendTyping();
+
+      let bubble = null;
+      let streamed = '';
+      let reply = null;
+
+      fetch(`/stream?msg=${encodeURIComponent(message)}`)
+        .then(response => readEventStream(response, (event, data) => {
+          if (event === 'done') {
+            reply = data.reply;
+            return;
+          }
+          // Show each chunk as soon as it arrives
+          if (!bubble) {
+            removeTyping();
+            bubble = appendStreamingBubble();
+          }
+          streamed += data.text;
+          bubble.textContent = streamed;
+          chatbox.scrollTop = chatbox.scrollHeight;
+        }))
+        .then(() => {
+          removeTyping();
+          if (reply === null) reply = streamed || "Sorry, something went wrong.";
+          if (bubble) {
+            bubble.innerHTML = linkify(reply);
+          } else {
+            appendMessage(reply, 'bot');
+          }
+
+          // Save conversation in history
+          conversationHistory.push({user: message, bot: reply});
+          renderChatHistory();
+        })
+        .catch(() => {
+          removeTyping();
+          appendMessage("Sorry, something went wrong.", 'bot');
+        })
+        .finally(() => {
+          userInput.disabled = false;
+          sendBtn.disabled = false;
+          voiceBtn.disabled = false;
+          userInput.focus();
+        });
+    }
+
+    sendBtn.addEventListener('click', sendMessage);
+    userInput.addEventListener('keydown', (e) => {
+      if (e.key === 'Enter') sendMessage();
+    });
+
+    // Voice input using Web Speech API
+    let recognition;
+    const SpeechRecognition = window.SpeechRecognition || window.webkitSpeechRecognition;
+    if (SpeechRecognition) {
+      recognition = new SpeechRecognition();
+      recognition.lang = 'en-US';
+      recognition.continuous = false;
+      recognition.interimResults = false;
+
+      // Ensure mic button is enabled when supported
+      voiceBtn.disabled = false;
+      voiceBtn.title = 'Start voice input';
+
+      recognition.onstart = () => {
+        voiceBtn.classList.add('listening');
+      };
+
+      recognition.onend = () => {
+        voiceBtn.classList.remove('listening');
+      };
+
+      recognition.onresult = function(event) {
+        const transcript = event.results[0][0].transcript;
+        // Put recognized text into the input box, but let the user decide when to send
+        userInput.value = transcript;
+        userInput.focus();
+      };
+
+      recognition.onerror = function(event) {
+        alert('Voice recognition error: ' + event.error);
+        voiceBtn.classList.remove('listening');
+      };
+    } else {
+      voiceBtn.disabled = true;
+      voiceBtn.title = 'Voice input not supported in this browser';
+    }
+
+    voiceBtn.addEventListener('click', () => {
+      if (recognition) {
+        recognition.start();
+      }
+    });
+
+    // Quick buttons: send preset messages or show modal
+    document.querySelectorAll('.quick-btn').forEach(btn => {
+      btn.addEventListener('click', () => {
+        const presetMsg = btn.getAttribute('data-msg');
+        const modalType = btn.getAttribute('data-modal');
+
+        if (modalType) {
+          showModal(modalType);
+        } else {
+          userInput.value = presetMsg;
+          sendMessage();
+        }
+      });
+    });
+
+    // Modal content for About Us and Contact
+    const modalData = {
+      about: {
+        title: "About Us",
+        content: `
+          <p>Welcome to Our School! We are committed to providing quality education and nurturing students for a better future.</p>
+          <p>Our mission is to empower students with knowledge, skills, and values.</p>
+        `
+      },
+      contact: {
+        title: "Contact Us",
+        content: `
+          <p>Email: ratnarajya2025@gmail.com</p>
+          <p>Phone: 078-402005</p>
+          <p>Address: Gaindakot-10,school chok</p>
+        `
+      }
+    };
+
+    // Show modal
+    function showModal(type) {
+      if (!modalData[type]) return;
+      modalTitle.innerHTML = modalData[type].title;
+      modalContent.innerHTML = modalData[type].content;
+      modalOverlay.style.display = 'flex';
+      modalOverlay.setAttribute('aria-hidden', 'false');
+      modalOverlay.focus();
+    }
+
+    // Close modal
+    function closeModal() {
+      modalOverlay.style.display = 'none';
+      modalOverlay.setAttribute('aria-hidden', 'true');
+    }
+
+    modalCloseBtn.addEventListener('click', closeModal);
+
+    // Close modal when clicking outside content
+    modalOverlay.addEventListener('click', (e) => {
+      if (e.target === modalOverlay) closeModal();
+    });
+
+    // Accessibility: close modal on Escape key
+    document.addEventListener('keydown', (e) => {
+      if (e.key === 'Escape' && modalOverlay.style.display === 'flex') {
+        closeModal();
+      }
+    });
+
+    // Clear chat button logic — clears history and chatbox instantly
+    clearChatBtn.addEventListener('click', () => {
+      conversationHistory = [];
+      chatbox.innerHTML = '';
+      renderChatHistory();
+      userInput.focus();
+    });
+
+    // Share button logic
+    shareBtn.addEventListener('click', async () => {
+      const shareData = {
+        title: 'Ratna Chatbot',
+        text: 'Check out this awesome chatbot!',
+        url: window.location.href
+      };
+
+      if (navigator.share) {
+        try {
+          await navigator.share(shareData);
+          console.log('Shared successfully');
+        } catch (err) {
+          alert('Share cancelled or failed');
+        }
+      } else {
+        // Fallback: copy URL to clipboard
+        try {
+          await navigator.clipboard.writeText(window.location.href);
+          alert('Chatbot link copied to clipboard!');
+        } catch {
+          alert('Failed to copy link. Please copy manually: ' + window.location.href);
+        }
+      }
+    });
+    // Open modal when feedback button clicked
+// Open modal when feedback button clicked
+document.querySelectorAll('button[data-modal="feedback"]').forEach(btn => {
+  btn.addEventListener('click', () => {
+    document.getElementById('modal-feedback').style.display = 'flex';
+    document.getElementById('feedbackResponse').style.display = 'none';
+    document.getElementById('feedbackForm').style.display = 'block';
+    document.getElementById('feedbackText').value = '';
+  });
+});
+
+// Close modal
+document.getElementById('closeFeedbackModal').addEventListener('click', () => {
+  document.getElementById('modal-feedback').style.display = 'none';
+});
+
+// Handle form submit
+document.getElementById('feedbackForm').addEventListener('submit', (e) => {
+  e.preventDefault();
+  const feedback = document.getElementById('feedbackText').value.trim();
+  if (feedback.length === 0) return;
+
+  // Send feedback to backend (example POST, you need to create endpoint)
+  fetch('/submit-feedback', {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify({feedback})
+  })
+  .then(res => {
+    if (res.ok) {
+      // Hide form, show thank you message
+      document.getElementById('feedbackForm').style.display = 'none';
+      document.getElementById('feedbackResponse').style.display = 'block';
+
+      // After 2 seconds, close modal and reset form & messages
+      setTimeout(() => {
+        document.getElementById('modal-feedback').style.display = 'none';
+        document.getElementById('feedbackForm').reset();
+        document.getElementById('feedbackForm').style.display = 'block';
+        document.getElementById('feedbackResponse').style.display = 'none';
+      }, 2000);
+    } else {
+      alert('Failed to send feedback. Please try again.');
+    }
+  })
+  .catch(() => alert('Failed to send feedback. Please try again.'));
+});
@@ -0,0 +1,11 @@
+import os, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Importing app opens its databases; keep them out of the working tree, and never call Gemini
+_workdir = tempfile.mkdtemp(prefix="ratna-tests-")
+for name in ("USERS_DB", "FEEDBACKS_DB", "CONVERSATIONS_DB", "METRICS_DB", "RATE_LIMIT_DB", "JOBS_DB"):
+    os.environ.setdefault(name, os.path.join(_workdir, name.lower().replace("_db", ".db")))
+os.environ.setdefault("GEMINI_BACKEND", "fake")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, ROOT)
@@ -0,0 +1,26 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def cache():
+    cache = app.AnswerCache(max_size=10, ttl=60)
+    cache.get("warm up", "v1")  # adopts the school info version
+    return cache
+
+
+def test_stores_and_serves_answers(cache):
+    cache.put("Tell me about the science lab", "The lab has ...", "v1")
+    assert cache.get("tell me about the science lab!", "v1") == "The lab has ..."
+
+
+@pytest.mark.parametrize("reply", [
+    "",
+    app.EMPTY_REPLY,
+    app.gemini_error_reply(app.google_exceptions.DeadlineExceeded("slow")),
+    app.gemini_error_reply(app.UpstreamUnavailable(5)),
+])
+def test_never_caches_error_replies(cache, reply):
+    cache.put("Tell me about the science lab", reply, "v1")
+    assert cache.get("Tell me about the science lab", "v1") is None
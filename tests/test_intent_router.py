@@ -0,0 +1,58 @@
+import pytest
+
+import app
+
+
+@pytest.fixture(scope="module")
+def router():
+    with open(app.SCHOOL_INFO_FILE, "r", encoding="utf-8") as f:
+        return app.IntentRouter(app.chunk_school_info(f.read()))
+
+
+@pytest.mark.parametrize("question, intent, expected", [
+    ("hello", "greeting", app.GREETING_REPLY),
+    ("Who is the principal?", "position", "Nawaraj Kafle"),
+    ("who is the school principal", "position", "Nawaraj Kafle"),
+    ("who is the bus driver", "position", "Bus Driver"),
+    ("Who is Nawaraj Kafle?", "staff", "Qualification: M.Ed"),
+    ("nawaraj kafle qualification", "staff", "Qualification: M.Ed"),
+    ("Who teaches Grade 10 'B'?", "class", "Chandrakanta Bhandari"),
+    ("Who teaches maths?", "subject", "Tak Narayan Rana"),
+    ("What is the school phone number?", "contact", "078-402005"),
+    ("What is your email?", "contact", "ratnarajya2025@gmail.com"),
+    ("What are the school timings?", "hours", "10:00 AM"),
+    ("When does school start?", "hours", "10:00 AM"),
+    ("When is the annual function?", "events", "Bhadra"),
+    ("show me the school phone number", "contact", "078-402005"),
+    ("Show the school hours", "hours", "10:00 AM"),
+    ("show me the events", "events", "Bhadra"),
+    ("show principal", "position", "Nawaraj Kafle"),
+])
+def test_answers_school_lookups_locally(router, question, intent, expected):
+    match = router.route(question)
+    assert match is not None and match.intent == intent
+    assert expected in match.reply
+
+
+@pytest.mark.parametrize("question", [
+    "how to send an email in python",
+    "How do I create a facebook account?",
+    "Explain the events that led to World War 1",
+    "Who is the principal of Harvard University?",
+    "Who is the driver of the bus in Speed movie?",
+    "Who is the principal of the Springfield hospital?",
+    "grade 10 syllabus",
+    "Who is Nawaraj Kafle and who teaches grade 10",
+    "Can you help me write an essay about my favourite teacher?",
+])
+def test_leaves_other_questions_to_gemini(router, question):
+    assert router.route(question) is None
+
+
+def test_counts_questions_left_to_gemini(router):
+    before = dict(router.stats)
+    router.route("Who is the principal of Harvard University?")
+    router.route("What is the capital of Nepal?")
+    assert router.stats["low_confidence"] == before["low_confidence"] + 1
+    assert router.stats["local"] == before["local"]
+    assert router.stats["requests"] == before["requests"] + 2
@@ -0,0 +1,44 @@
+import os, shutil
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def knowledge_base(tmp_path):
+    path = tmp_path / "school_info.txt"
+    shutil.copy(app.SCHOOL_INFO_FILE, path)
+    base = app.SchoolKnowledgeBase(str(path), check_interval=0)
+    base.current()
+    return base, path
+
+
+def rewrite(path, text):
+    stat = os.stat(path)
+    path.write_text(text, encoding="utf-8")
+    # Make sure the reload check sees a new signature even within one mtime tick
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_reloads_an_edited_file(knowledge_base):
+    base, path = knowledge_base
+    before = base.current()
+    rewrite(path, path.read_text(encoding="utf-8").replace("078-402005", "078-999999"))
+    after = base.current()
+    assert after.version != before.version
+    assert "078-999999" in after.router.route("What is the school phone number?").reply
+
+
+@pytest.mark.parametrize("damage", [
+    lambda text: "asdf qwerty\n",
+    lambda text: text[:text.index("Teachers and Staffs details:")],
+    lambda text: text.replace("School Hours:", "Hours we are open:"),
+    lambda text: text[:text.index("4. Name:")],  # most staff entries lost
+])
+def test_keeps_the_previous_version_when_the_file_is_damaged(knowledge_base, damage):
+    base, path = knowledge_base
+    before = base.current()
+    rewrite(path, damage(path.read_text(encoding="utf-8")))
+    assert base.current() is before
+    assert base.stats["reload_errors"] == 1
@@ -0,0 +1,14 @@
+import app
+
+
+def test_fingerprinted_assets_do_not_vary_on_cookie():
+    client = app.app.test_client()
+    client.get("/use-guest")  # the browser now sends a session cookie
+    with app.app.test_request_context():
+        url = app.asset_url("js/chat.js")
+
+    response = client.get(url)
+
+    assert response.status_code == 200
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "Cookie" not in response.headers.get("Vary", "")